@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
 import numpy as np
+import pandas as pd
 from matplotlib import cm
 from matplotlib import pyplot as plt
+from backtest_crypto.utilities.data_structs import TIME_INTERVAL_DIMS
 from backtest_crypto.utilities.iterators import TimeIntervalIterator
 
 
@@ -38,8 +40,13 @@ class AbstractGraphConcrete(ABC):
                              multiplier):
         if list_of_items.dtype == np.dtype('<m8[ns]'):
             list_of_items = list(map(lambda x: x.to_pytimedelta().days, list_of_items))
+        if getattr(list_of_items, "name", None) in TIME_INTERVAL_DIMS:
+            list_of_items = list_of_items.values / 1000
+        # Datasets gathered before the intervals had dims of their own
+        elif isinstance(list_of_items, pd.MultiIndex):
+            list_of_items = TimeIntervalIterator.get_time_interval_list(list(list_of_items))
         # TODO Very broad condition
-        if all(isinstance(
+        elif all(isinstance(
             item, str
         ) for item in list_of_items):
             list_of_items = TimeIntervalIterator.get_time_interval_list(list_of_items)
@@ -47,19 +54,26 @@ class AbstractGraphConcrete(ABC):
 
 
 class SurfaceGraph3DConcrete(AbstractGraphConcrete):
+    @staticmethod
+    def get_time_dim(values_to_plot):
+        """The dim the time intervals vary along, the other interval dim holds the fixed start or end"""
+        if "time_intervals" in values_to_plot.dims:
+            return "time_intervals"
+        return "interval_start" if values_to_plot.sizes["interval_end"] == 1 else "interval_end"
+
     def get_x_y_axis(self,
                      surface_graph_axes,
                      values_to_plot):
         if "time_intervals" in surface_graph_axes:
-            time_index_in_axes = surface_graph_axes.index("time_intervals")
             other_index_in_axes = surface_graph_axes.index([item for item in surface_graph_axes if item != "time_intervals"][0])
-            time_index = values_to_plot.get_index(surface_graph_axes[time_index_in_axes])
+            time_index = values_to_plot.get_index(self.get_time_dim(values_to_plot))
             other_index = values_to_plot.get_index(surface_graph_axes[other_index_in_axes])
 
             x_axis = self.get_axes_for_surface(time_index, len(other_index))
             y_axis = self.get_axes_for_surface(other_index, len(time_index))
         else:
-            values_to_plot = values_to_plot.mean(dim="time_intervals")
+            values_to_plot = values_to_plot.mean(dim=[dim for dim in ("time_intervals",) + TIME_INTERVAL_DIMS
+                                                      if dim in values_to_plot.dims])
             x_index = values_to_plot.get_index(surface_graph_axes[0])
             y_index = values_to_plot.get_index(surface_graph_axes[1])
 
@@ -71,9 +85,10 @@ class SurfaceGraph3DConcrete(AbstractGraphConcrete):
 
     @staticmethod
     def get_time_sorted_ds(dataset):
-        sorted_ts = dataset.time_intervals.values.tolist()
-        sorted_ts.sort()
-        return dataset.sel({"time_intervals": sorted_ts})
+        if "time_intervals" not in dataset.dims:
+            # interval_start and interval_end are sorted dims
+            return dataset
+        return dataset.isel({"time_intervals": dataset.get_index("time_intervals").argsort()})
 
     def generate_graph(self,
                        data_vars,
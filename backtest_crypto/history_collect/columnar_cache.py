@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pathlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+logger = logging.getLogger(__package__)
+
+CandleArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class ColumnarHistoryCache:
+    """
+    Binary copy of the SQLite coin history, one directory per candle holding the
+    values (timestamp x base_asset), the timestamps and the base-asset names as .npy files.
+    The SQLite file stays the source of truth: the cache is rebuilt whenever the size,
+    mtime or row watermark of the DB changes
+    """
+    manifest_name = "manifest.json"
+    array_names = ("values", "timestamps", "base_assets")
+
+    def __init__(self,
+                 cache_dir,
+                 sqlite_db_path,
+                 engine):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.sqlite_db_path = pathlib.Path(sqlite_db_path)
+        self.engine = engine
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        return self.cache_dir / self.manifest_name
+
+    def get_fingerprint(self,
+                        table_name_list: List[str]) -> Dict:
+        stat = os.stat(self.sqlite_db_path)
+        with self.engine.connect() as connection:
+            watermarks = {table_name: connection.execute(text(f"SELECT MAX(rowid) FROM {table_name}")).scalar()
+                          for table_name in table_name_list}
+        return {"size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "row_watermarks": watermarks}
+
+    def read_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, "r") as fp:
+                return json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def is_valid(self,
+                 table_name_list: List[str],
+                 query_details: Dict) -> bool:
+        manifest = self.read_manifest()
+        if not manifest:
+            return False
+        return (manifest["fingerprint"] == self.get_fingerprint(table_name_list)) and \
+               (manifest["query_details"] == query_details)
+
+    def load(self) -> Dict[str, CandleArrays]:
+        manifest = self.read_manifest()
+        candle_arrays = {}
+        for candle in manifest["candles"]:
+            candle_dir = self.cache_dir / candle
+            values, timestamps, base_assets = (np.load(candle_dir / f"{name}.npy", mmap_mode="r")
+                                               for name in self.array_names)
+            candle_arrays[candle] = (values, timestamps, base_assets)
+        logger.info(f"Opened the cached history in {self.cache_dir}")
+        return candle_arrays
+
+    def store(self,
+              candle_arrays: Dict[str, CandleArrays],
+              table_name_list: List[str],
+              query_details: Dict):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()
+        for candle, arrays in candle_arrays.items():
+            candle_dir = self.cache_dir / candle
+            candle_dir.mkdir(exist_ok=True)
+            for name, array in zip(self.array_names, arrays):
+                np.save(candle_dir / f"{name}.npy", array, allow_pickle=False)
+        manifest = {"fingerprint": self.get_fingerprint(table_name_list),
+                    "query_details": query_details,
+                    "candles": list(candle_arrays.keys())}
+        with open(self.manifest_path, "w") as fp:
+            json.dump(manifest, fp)
+        logger.info(f"Stored the history cache in {self.cache_dir}")
@@ -2,16 +2,23 @@ from __future__ import annotations
 
 import datetime
 import logging
+import os
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
 
 import numpy as np
 import pandas as pd
 import xarray as xr
 from crypto_history.utilities.general_utilities import register_factory
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
 
-from backtest_crypto.utilities.general import InsufficientHistory
+from backtest_crypto.utilities.general import InsufficientHistory, datetime_to_ms
+from backtest_crypto.utilities.iterators import TimeIntervalIterator
 from backtest_crypto.history_collect.clean_history import remove_duplicates
+from backtest_crypto.history_collect.columnar_cache import ColumnarHistoryCache
+from backtest_crypto.history_collect.price_matrix import PriceMatrix, InstantPrices, exclusive_row_range
 
 logger = logging.getLogger(__package__)
 
@@ -52,12 +59,6 @@ class ConcreteAbstractCoinHistoryAccess:
         pass
 
     def store_largest_da_on_borg(self, full_history_da_dict):
-        # TODO Certainly better ways to do it
-        for key in full_history_da_dict.keys():
-            for ohlcv_field in full_history_da_dict[key].ohlcv_fields.values:
-                if ohlcv_field != "weight":
-                    full_history_da_dict[key].loc[{"ohlcv_fields": ohlcv_field}] = \
-                        full_history_da_dict[key].loc[{"ohlcv_fields": ohlcv_field}].astype(float)
         self.largest_xarray_dict = full_history_da_dict
 
     def get_full_history_store(self) -> FullHistoryStore:
@@ -78,7 +79,12 @@ class ConcreteSQLiteCoinHistoryAccess(ConcreteAbstractCoinHistoryAccess):
                  reference_coin,
                  file_path,
                  mapped_class,
-                 table_name_list
+                 table_name_list,
+                 cache_dir=None,
+                 coin_universe=None,
+                 chunksize=50000,
+                 dtype=np.float64,
+                 index_timestamps=True
                  ):
         super(ConcreteSQLiteCoinHistoryAccess, self).__init__()
         self.largest_xarray = None
@@ -95,37 +101,165 @@ class ConcreteSQLiteCoinHistoryAccess(ConcreteAbstractCoinHistoryAccess):
         )
         self.mapped_class = mapped_class
         self.table_name_list = table_name_list
+        self.coin_universe = coin_universe
+        self.chunksize = chunksize
+        self.dtype = np.dtype(dtype)
+        if index_timestamps:
+            self.create_timestamp_indexes()
+        self.history_cache = None
+        if cache_dir is not None:
+            self.history_cache = ColumnarHistoryCache(cache_dir,
+                                                      file_path,
+                                                      self.engine)
+
+    def has_timestamp_index(self,
+                            inspector,
+                            table_name) -> bool:
+        if inspector.get_pk_constraint(table_name)["constrained_columns"] == ["timestamp"]:
+            return True
+        return any(index["column_names"][:1] == ["timestamp"] for index in inspector.get_indexes(table_name))
+
+    def create_timestamp_indexes(self):
+        """
+        Indexes the timestamp of the tables lacking such an index. Done once on construction rather than on
+        every load, as any DDL touches the DB file whose mtime the history cache is keyed on
+        """
+        inspector = inspect(self.engine)
+        for table_name in self.table_name_list:
+            if self.has_timestamp_index(inspector, table_name):
+                continue
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_timestamp" '
+                                            f'ON "{table_name}" (timestamp)'))
+            except OperationalError as e:
+                logger.warning(f"Could not create the timestamp index on {table_name}. Reason {e}")
+
+    def get_selected_columns(self,
+                             table_name):
+        columns = [column["name"] for column in inspect(self.engine).get_columns(table_name)
+                   if column["name"] != "timestamp"]
+        if self.coin_universe is not None:
+            coin_universe = set(self.coin_universe)
+            columns = [column for column in columns if column in coin_universe]
+        return columns
+
+    def get_time_range_clause(self):
+        clauses = []
+        params = {}
+        if self.overall_start is not None:
+            clauses.append("timestamp >= :overall_start")
+            params["overall_start"] = datetime_to_ms(self.overall_start)
+        if self.overall_end is not None:
+            clauses.append("timestamp <= :overall_end")
+            params["overall_end"] = datetime_to_ms(self.overall_end)
+        if not clauses:
+            return "", params
+        return f" WHERE {' AND '.join(clauses)}", params
+
+    def read_table(self,
+                   table_name):
+        """The selected rows and columns of a table, filled chunk by chunk into arrays sized by a row count"""
+        columns = self.get_selected_columns(table_name)
+        selected_columns = ", ".join(f'"{column}"' for column in ["timestamp", *columns])
+        where_clause, params = self.get_time_range_clause()
+        query = text(f'SELECT {selected_columns} FROM "{table_name}"{where_clause}')
+        with self.engine.connect() as connection:
+            row_count = connection.execute(text(f'SELECT COUNT(*) FROM "{table_name}"{where_clause}'),
+                                           params).scalar()
+            values = np.empty((row_count, len(columns)), dtype=self.dtype)
+            timestamps = np.empty(row_count, dtype=np.int64)
+            filled = 0
+            for chunk in pd.read_sql(query,
+                                     con=connection,
+                                     params=params,
+                                     chunksize=self.chunksize):
+                chunk_end = filled + len(chunk)
+                if chunk_end > len(timestamps):
+                    # Rows written since the count
+                    extra_rows = max(chunk_end, 2 * len(timestamps)) - len(timestamps)
+                    values = np.concatenate([values, np.empty((extra_rows, len(columns)), dtype=self.dtype)])
+                    timestamps = np.concatenate([timestamps, np.empty(extra_rows, dtype=np.int64)])
+                values[filled:chunk_end] = chunk[columns].to_numpy(dtype=self.dtype, na_value=np.nan)
+                timestamps[filled:chunk_end] = chunk["timestamp"].to_numpy(dtype=np.int64)
+                filled = chunk_end
+        return pd.DataFrame(values[:filled],
+                            index=pd.Index(timestamps[:filled], name="timestamp"),
+                            columns=columns,
+                            copy=False)
 
     def get_list_of_df(self):
-        df_dict = {}
-        for table_name in self.table_name_list:
-            raw_df = pd.read_sql_table(table_name, con=self.engine)
-            raw_df = raw_df.set_index('timestamp', drop=True)
-            df_dict[table_name.split("_")[-1]] = raw_df
-        return df_dict
+        if not self.table_name_list:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(len(self.table_name_list), os.cpu_count() or 1))) as executor:
+            raw_dfs = list(executor.map(self.read_table, self.table_name_list))
+        return {table_name.split("_")[-1]: raw_df
+                for table_name, raw_df in zip(self.table_name_list, raw_dfs)}
 
     def df_to_xarray(self,
                      candle,
                      df):
-        underlying_np = np.array([[df.values, np.full(df.shape, candle)]])
-        return xr.DataArray(underlying_np,
+        return self.arrays_to_xarray(candle,
+                                     df.values,
+                                     df.index.values,
+                                     df.columns.values)
+
+    def arrays_to_xarray(self,
+                         candle,
+                         values,
+                         timestamps,
+                         base_assets):
+        if values.dtype != self.dtype:
+            values = values.astype(self.dtype)
+        return xr.DataArray(values[np.newaxis, np.newaxis],
                             dims=["reference_assets",
                                   "ohlcv_fields",
                                   "timestamp",
                                   "base_assets"],
                             coords=[
                                 [self.reference_coin],
-                                [self.ohlcv_field, "weight"],
-                                df.index,
-                                df.columns])
+                                [self.ohlcv_field],
+                                timestamps,
+                                base_assets],
+                            attrs={"candle": candle})
+
+    def get_query_details(self):
+        where_clause, params = self.get_time_range_clause()
+        return {"table_name_list": list(self.table_name_list),
+                "reference_coin": self.reference_coin,
+                "ohlcv_field": self.ohlcv_field,
+                "dtype": self.dtype.str,
+                "time_range": params,
+                "coin_universe": None if self.coin_universe is None else sorted(self.coin_universe)}
+
+    def get_candle_arrays_from_sql(self):
+        candle_arrays = {}
+        for candle, df in self.get_list_of_df().items():
+            logger.info("Finished accessing the sql to generate the df")
+            non_duplicate_df = remove_duplicates(df)
+            candle_arrays[candle] = (np.ascontiguousarray(non_duplicate_df.values, dtype=self.dtype),
+                                     non_duplicate_df.index.values.astype(np.int64),
+                                     np.asarray(non_duplicate_df.columns, dtype=str))
+        return candle_arrays
+
+    def get_candle_arrays(self):
+        if self.history_cache is None:
+            return self.get_candle_arrays_from_sql()
+        query_details = self.get_query_details()
+        if not self.history_cache.is_valid(self.table_name_list,
+                                           query_details):
+            self.history_cache.store(self.get_candle_arrays_from_sql(),
+                                     self.table_name_list,
+                                     query_details)
+        return self.history_cache.load()
 
     def get_fresh_xarray(self):
-        df_dict = self.get_list_of_df()
         x_array_dict = {}
-        for candle, df in df_dict.items():
-            logger.info("Finished accessing the sql to generate the df")
-            non_duplicate_df = remove_duplicates(df)
-            x_array_dict[candle] = self.df_to_xarray(candle, non_duplicate_df)
+        for candle, (values, timestamps, base_assets) in self.get_candle_arrays().items():
+            x_array_dict[candle] = self.arrays_to_xarray(candle,
+                                                         values,
+                                                         timestamps,
+                                                         base_assets)
         return x_array_dict
 
 
@@ -134,21 +268,57 @@ class FullHistoryStore:
                  dataarray):
         self.dataarray = dataarray
         self.timestamp_dict = {}
+        self.price_matrix_dict = {}
+
+    @classmethod
+    def from_price_matrices(cls,
+                            price_matrix_dict: Dict[str, PriceMatrix],
+                            reference_coin,
+                            ohlcv_field):
+        dataarray = {}
+        for candle, price_matrix in price_matrix_dict.items():
+            dataarray[candle] = xr.DataArray(price_matrix.values[np.newaxis, np.newaxis],
+                                             dims=["reference_assets",
+                                                   "ohlcv_fields",
+                                                   "timestamp",
+                                                   "base_assets"],
+                                             coords=[
+                                                 [reference_coin],
+                                                 [ohlcv_field],
+                                                 price_matrix.timestamps,
+                                                 price_matrix.base_assets],
+                                             attrs={"candle": candle})
+        full_history_store = cls(dataarray)
+        for candle, price_matrix in price_matrix_dict.items():
+            full_history_store.price_matrix_dict[candle, ohlcv_field] = price_matrix
+        return full_history_store
+
+    def get_price_matrix(self,
+                         candle,
+                         ohlcv_field="open") -> PriceMatrix:
+        if (candle, ohlcv_field) not in self.price_matrix_dict.keys():
+            self.get_timestamps(candle)
+            self.price_matrix_dict[candle, ohlcv_field] = PriceMatrix.from_dataarray(self.dataarray[candle],
+                                                                                     ohlcv_field)
+        return self.price_matrix_dict[candle, ohlcv_field]
+
+    def get_instantaneous_prices(self,
+                                 current_time,
+                                 candle,
+                                 ohlcv_field="open") -> InstantPrices:
+        price_matrix = self.get_price_matrix(candle, ohlcv_field)
+        try:
+            return price_matrix.instant_prices(datetime_to_ms(current_time))
+        except KeyError:
+            raise InsufficientHistory(f"History not present in {current_time}")
 
     def get_instantaneous_history(self,
                                   current_time,
                                   candle,
                                   ohlcv_field="open"):
-        da = self.dataarray[candle]
-        try:
-            instant_history = da.sel(timestamp=current_time.timestamp() * 1000)
-        except KeyError:
-            raise InsufficientHistory(f"History not present in {current_time}")
-        da = instant_history.dropna("base_assets")
-        da_dict = da.loc[{"ohlcv_fields": ohlcv_field}].to_dict()
-        return dict(zip(da_dict["coords"]["base_assets"]["data"],
-                        map(float, da_dict["data"][0])
-                        ))
+        return self.get_instantaneous_prices(current_time,
+                                             candle,
+                                             ohlcv_field).to_dict()
 
     def select_history(self,
                        start: datetime.datetime,
@@ -161,19 +331,26 @@ class FullHistoryStore:
             end = start
             start = temp_end
             logger.warning("Switching start and end in select history as start is after end")
-        # TODO Potential for improvement here
-        timestamp_list = self.get_timestamps(candle)
-        starter = start.timestamp() * 1000
-        ender = end.timestamp() * 1000
-        filtered_timestamps = [item for item in timestamp_list if starter < item < ender]
-        return dataarray.sel(timestamp=filtered_timestamps)
-
-    def get_merged_histories(self,
-                             start_time,
-                             end_time,
-                             backward_details,
-                             remaining):
-        sub_histories = []
+        lower, upper = self.get_timestamp_range(start,
+                                                end,
+                                                candle)
+        return dataarray.isel(timestamp=slice(lower, upper))
+
+    def get_timestamp_range(self,
+                            start: datetime.datetime,
+                            end: datetime.datetime,
+                            candle):
+        return exclusive_row_range(self.get_timestamps(candle),
+                                   start.timestamp() * 1000,
+                                   end.timestamp() * 1000)
+
+    def get_merged_ranges(self,
+                          start_time,
+                          end_time,
+                          backward_details,
+                          remaining):
+        """(candle, lower, upper) row ranges the merged history of the window is made of, in time order"""
+        sub_ranges = []
         sub_end = start_time
         for sub_start_tdelta, sub_end_tdelta, candle in backward_details:
             sub_start = end_time + sub_start_tdelta
@@ -182,19 +359,60 @@ class FullHistoryStore:
                 sub_start = start_time
             if sub_end < start_time:
                 sub_end = start_time
-            sub_history = self.select_history(sub_start,
-                                              sub_end,
-                                              self.dataarray[candle],
-                                              candle=candle)
-            sub_histories.append(sub_history)
-        sub_histories.append(self.select_history(sub_end,
-                                                 start_time,
-                                                 self.dataarray[remaining],
-                                                 candle=remaining))
+            sub_ranges.append((candle, *self.get_timestamp_range(min(sub_start, sub_end),
+                                                                 max(sub_start, sub_end),
+                                                                 candle)))
+        sub_ranges.append((remaining, *self.get_timestamp_range(start_time,
+                                                                sub_end,
+                                                                remaining)))
+        sub_ranges.sort(key=lambda x: self.get_range_bounds(*x))
+        return sub_ranges
+
+    def get_merged_histories(self,
+                             start_time,
+                             end_time,
+                             backward_details,
+                             remaining):
+        sub_ranges = self.get_merged_ranges(start_time,
+                                            end_time,
+                                            backward_details,
+                                            remaining)
+        sub_histories = [self.get_candle_history(candle, lower, upper)
+                         for candle, lower, upper in sub_ranges]
         joined_xarray = xr.concat([*sub_histories], dim="timestamp")
         # TODO Raise an error if history is empty
+        if self.are_ranges_disjoint(sub_ranges):
+            return joined_xarray
         return joined_xarray.sortby("timestamp")
 
+    def get_candle_history(self,
+                           candle,
+                           lower,
+                           upper):
+        """
+        Rows `lower` to `upper` of the candle's history with the candle width in ms as a float `weight`
+        coordinate along timestamp, so merged histories of several candles keep the width of every row
+        """
+        history = self.dataarray[candle].isel(timestamp=slice(lower, upper))
+        return history.assign_coords(weight=("timestamp", np.full(history.sizes["timestamp"],
+                                                                  get_candle_width_ms(candle),
+                                                                  dtype=np.float64)))
+
+    def get_range_bounds(self,
+                         candle,
+                         lower,
+                         upper):
+        timestamps = self.get_timestamps(candle)
+        if lower >= upper:
+            return np.inf, np.inf
+        return timestamps[lower], timestamps[upper - 1]
+
+    def are_ranges_disjoint(self,
+                            sorted_ranges) -> bool:
+        bounds = [self.get_range_bounds(*item) for item in sorted_ranges]
+        bounds = [item for item in bounds if item[0] != np.inf]
+        return all(previous[1] < following[0] for previous, following in zip(bounds, bounds[1:]))
+
     def get_simple_history(self,
                            start_time,
                            end_time,
@@ -205,12 +423,18 @@ class FullHistoryStore:
                                    candle)
 
     def get_timestamps(self,
-                       candle):
+                       candle) -> np.ndarray:
         if candle not in self.timestamp_dict.keys():
-            self.timestamp_dict[candle] = self.dataarray[candle].timestamp.values.tolist()
+            if not self.dataarray[candle].get_index("timestamp").is_monotonic_increasing:
+                self.dataarray[candle] = self.dataarray[candle].sortby("timestamp")
+            self.timestamp_dict[candle] = self.dataarray[candle].timestamp.values
         return self.timestamp_dict[candle]
 
 
+def get_candle_width_ms(candle: str) -> float:
+    return TimeIntervalIterator.string_to_datetime(candle).total_seconds() * 1000
+
+
 def store_largest_xarray(creator: AbstractRawHistoryObtainCreator,
                          overall_start,
                          overall_end,
@@ -246,3 +470,10 @@ def get_instantaneous_history_from_datarray(datarray_object: FullHistoryStore,
                                             candle):
     return datarray_object.get_instantaneous_history(current_time,
                                                      candle)
+
+
+def get_instantaneous_prices_from_datarray(datarray_object: FullHistoryStore,
+                                           current_time,
+                                           candle):
+    return datarray_object.get_instantaneous_prices(current_time,
+                                                    candle)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def exclusive_row_range(timestamps: np.ndarray,
+                        start_ms,
+                        end_ms):
+    """Rows of the sorted `timestamps` lying strictly between `start_ms` and `end_ms`"""
+    lower = int(np.searchsorted(timestamps, start_ms, side="right"))
+    upper = int(np.searchsorted(timestamps, end_ms, side="left"))
+    return lower, max(lower, upper)
+
+
+class PriceMatrix:
+    """Contiguous float prices of a single candle laid out as timestamp x base_asset"""
+    crossing_block_size = 64
+
+    def __init__(self,
+                 values,
+                 timestamps,
+                 base_assets):
+        values = np.asarray(values)
+        if values.dtype.kind != "f":
+            values = values.astype(np.float64)
+        self.values = np.ascontiguousarray(values)
+        self.timestamps = np.asarray(timestamps).astype(np.int64)
+        self.base_assets = np.asarray(base_assets, dtype=str)
+        if self.values.shape != (len(self.timestamps), len(self.base_assets)):
+            raise ValueError(f"Price matrix of shape {self.values.shape} does not match "
+                             f"{len(self.timestamps)} timestamps and {len(self.base_assets)} base assets")
+        self.timestamp_index = dict(zip(self.timestamps.tolist(), range(len(self.timestamps))))
+        self.coin_index = dict(zip(self.base_assets.tolist(), range(len(self.base_assets))))
+        self._cumulative_values = None
+        self._cumulative_valid_count = None
+        self._block_maxima = None
+        self._block_minima = None
+
+    @classmethod
+    def from_dataarray(cls,
+                       dataarray,
+                       ohlcv_field):
+        field_da = dataarray.loc[{"ohlcv_fields": ohlcv_field}].isel(reference_assets=0)
+        field_da = field_da.transpose("timestamp", "base_assets")
+        return cls(field_da.values,
+                   field_da.timestamp.values,
+                   field_da.base_assets.values)
+
+    def row_index(self,
+                  timestamp_ms: int) -> int:
+        return self.timestamp_index[timestamp_ms]
+
+    def row(self,
+            timestamp_ms: int) -> np.ndarray:
+        return self.values[self.row_index(timestamp_ms)]
+
+    def row_range(self,
+                  start_ms,
+                  end_ms):
+        return exclusive_row_range(self.timestamps,
+                                   start_ms,
+                                   end_ms)
+
+    @property
+    def cumulative_values(self) -> np.ndarray:
+        """Running sum of the prices along time with a leading zero row, NaN counted as 0"""
+        if self._cumulative_values is None:
+            cumulative = np.zeros((len(self.timestamps) + 1, len(self.base_assets)), dtype=np.float64)
+            np.cumsum(np.nan_to_num(self.values, nan=0.0), axis=0, out=cumulative[1:])
+            self._cumulative_values = cumulative
+        return self._cumulative_values
+
+    @property
+    def cumulative_valid_count(self) -> np.ndarray:
+        """Running count of the non-NaN prices along time with a leading zero row"""
+        if self._cumulative_valid_count is None:
+            cumulative = np.zeros((len(self.timestamps) + 1, len(self.base_assets)), dtype=np.int64)
+            np.cumsum(~np.isnan(self.values), axis=0, out=cumulative[1:])
+            self._cumulative_valid_count = cumulative
+        return self._cumulative_valid_count
+
+    def get_block_extrema(self,
+                          reduce_function) -> np.ndarray:
+        block_size = self.crossing_block_size
+        block_count = -(-len(self.timestamps) // block_size)
+        padded = np.full((block_count * block_size, len(self.base_assets)), np.nan, dtype=self.values.dtype)
+        padded[:len(self.timestamps)] = self.values
+        return reduce_function.reduce(padded.reshape(block_count, block_size, -1), axis=1)
+
+    @property
+    def block_maxima(self) -> np.ndarray:
+        """Highest price of each coin per block of `crossing_block_size` timestamps, NaN for blocks without one"""
+        if self._block_maxima is None:
+            self._block_maxima = self.get_block_extrema(np.fmax)
+        return self._block_maxima
+
+    @property
+    def block_minima(self) -> np.ndarray:
+        if self._block_minima is None:
+            self._block_minima = self.get_block_extrema(np.fmin)
+        return self._block_minima
+
+    def first_crossing_row(self,
+                           from_row: int,
+                           column: int,
+                           threshold: float,
+                           above: bool) -> int:
+        """
+        First row at or after `from_row` where the coin's price is >= `threshold` (or <= when not `above`),
+        len(timestamps) when there is none. Whole blocks are skipped on their extrema
+        """
+        def crossing(prices):
+            return prices >= threshold if above else prices <= threshold
+
+        block_size = self.crossing_block_size
+        head_end = min(len(self.timestamps), (from_row // block_size + 1) * block_size)
+        head_hits = crossing(self.values[from_row:head_end, column])
+        if head_hits.any():
+            return from_row + int(np.argmax(head_hits))
+        first_block = head_end // block_size
+        block_extrema = self.block_maxima if above else self.block_minima
+        block_hits = crossing(block_extrema[first_block:, column])
+        if not block_hits.any():
+            return len(self.timestamps)
+        block_start = (first_block + int(np.argmax(block_hits))) * block_size
+        return block_start + int(np.argmax(crossing(self.values[block_start:block_start + block_size, column])))
+
+    def get_full_history_mask(self,
+                              start_ms,
+                              end_ms) -> np.ndarray:
+        """Per coin, whether it has a price at every timestamp strictly between `start_ms` and `end_ms`"""
+        lower, upper = self.row_range(start_ms, end_ms)
+        valid_count = self.cumulative_valid_count[upper] - self.cumulative_valid_count[lower]
+        return valid_count == (upper - lower)
+
+    def instant_prices(self,
+                       timestamp_ms: int) -> InstantPrices:
+        return InstantPrices(self.row(timestamp_ms),
+                             self.coin_index,
+                             self.base_assets)
+
+
+class InstantPrices(Mapping):
+    """Read-only coin -> price view on one row of a PriceMatrix. Coins without a price are absent"""
+
+    def __init__(self,
+                 row,
+                 coin_index,
+                 base_assets):
+        self.row = row
+        self.coin_index = coin_index
+        self.base_assets = base_assets
+        self._available = None
+
+    @property
+    def available(self) -> np.ndarray:
+        if self._available is None:
+            self._available = ~np.isnan(self.row)
+        return self._available
+
+    def __getitem__(self, coin):
+        price = self.row[self.coin_index[coin]]
+        if price != price:
+            raise KeyError(coin)
+        return float(price)
+
+    def __contains__(self, coin):
+        try:
+            self[coin]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.base_assets[self.available].tolist())
+
+    def __len__(self):
+        return int(self.available.sum())
+
+    def to_dict(self):
+        return dict(zip(self.base_assets[self.available].tolist(),
+                        self.row[self.available].tolist()))
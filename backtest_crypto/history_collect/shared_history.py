@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List
+
+import numpy as np
+
+from backtest_crypto.history_collect.gather_history import FullHistoryStore
+from backtest_crypto.history_collect.price_matrix import PriceMatrix
+
+logger = logging.getLogger(__package__)
+_attach_lock = threading.Lock()
+
+
+def attach_shared_memory(name) -> shared_memory.SharedMemory:
+    """
+    Attaches to a segment without registering it with the resource tracker: a tracker of its own would unlink
+    it or warn about a leak once the attaching process exits. Unregistering after attaching is no option, pool
+    workers share the tracker of the publisher, which owns and unlinks the segment
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+@dataclass
+class SharedCandle:
+    candle: str
+    shared_memory_name: str
+    shape: tuple
+    dtype: str
+    timestamps: np.ndarray
+    base_assets: np.ndarray
+
+
+@dataclass
+class SharedHistoryHandle:
+    """Picklable description of a published history. Only names and the small axes cross the process boundary"""
+    reference_coin: str
+    ohlcv_field: str
+    candles: List[SharedCandle]
+
+    def attach(self) -> FullHistoryStore:
+        attached_memory = []
+        price_matrices = {}
+        for shared_candle in self.candles:
+            memory = attach_shared_memory(shared_candle.shared_memory_name)
+            attached_memory.append(memory)
+            values = np.ndarray(shared_candle.shape,
+                                dtype=np.dtype(shared_candle.dtype),
+                                buffer=memory.buf)
+            values.flags.writeable = False
+            price_matrices[shared_candle.candle] = PriceMatrix(values,
+                                                               shared_candle.timestamps,
+                                                               shared_candle.base_assets)
+        full_history_store = FullHistoryStore.from_price_matrices(price_matrices,
+                                                                  self.reference_coin,
+                                                                  self.ohlcv_field)
+        # The buffers are only valid while the SharedMemory objects are alive
+        full_history_store.shared_memory = attached_memory
+        return full_history_store
+
+
+class SharedHistoryPublisher:
+    """Copies the price matrices of a FullHistoryStore into shared memory once, for worker processes to attach"""
+
+    def __init__(self,
+                 full_history_store: FullHistoryStore,
+                 reference_coin,
+                 ohlcv_field):
+        self.full_history_store = full_history_store
+        self.reference_coin = reference_coin
+        self.ohlcv_field = ohlcv_field
+        self.published_memory: Dict[str, shared_memory.SharedMemory] = {}
+
+    def publish(self) -> SharedHistoryHandle:
+        shared_candles = []
+        for candle in self.full_history_store.dataarray.keys():
+            price_matrix = self.full_history_store.get_price_matrix(candle,
+                                                                    self.ohlcv_field)
+            memory = shared_memory.SharedMemory(create=True,
+                                                size=max(price_matrix.values.nbytes, 1))
+            self.published_memory[candle] = memory
+            shared_values = np.ndarray(price_matrix.values.shape,
+                                       dtype=price_matrix.values.dtype,
+                                       buffer=memory.buf)
+            shared_values[:] = price_matrix.values
+            shared_candles.append(SharedCandle(candle=candle,
+                                               shared_memory_name=memory.name,
+                                               shape=price_matrix.values.shape,
+                                               dtype=price_matrix.values.dtype.str,
+                                               timestamps=price_matrix.timestamps,
+                                               base_assets=price_matrix.base_assets))
+            logger.debug(f"Published {price_matrix.values.nbytes} bytes of {candle} history as {memory.name}")
+        return SharedHistoryHandle(reference_coin=self.reference_coin,
+                                   ohlcv_field=self.ohlcv_field,
+                                   candles=shared_candles)
+
+    def close(self):
+        for memory in self.published_memory.values():
+            memory.close()
+            memory.unlink()
+        self.published_memory = {}
+
+    def __enter__(self) -> SharedHistoryHandle:
+        return self.publish()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,9 +1,46 @@
 from __future__ import annotations
+import numpy as np
 import pandas as pd
 import xarray as xr
-from typing import TYPE_CHECKING, Dict
+from typing import TYPE_CHECKING, Dict, List, Tuple
 if TYPE_CHECKING:
     from backtest_crypto.utilities.iterators import TimeIntervalIterator
+    from backtest_crypto.utilities.parameter_grid import ParameterGrid
+
+
+TIME_INTERVAL_DIMS = ("interval_start", "interval_end")
+
+
+def split_time_intervals(time_intervals) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sorted unique int64 starts and ends of (start_ms, end_ms) pairs, with the position of every pair on both.
+    A TimeIntervalIterator keeps either the start or the end fixed, so the pairs fill the start x end grid
+    """
+    starts, ends = (np.array(level, dtype=np.int64) for level in zip(*time_intervals)) \
+        if len(time_intervals) else (np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    unique_starts, start_positions = np.unique(starts, return_inverse=True)
+    unique_ends, end_positions = np.unique(ends, return_inverse=True)
+    return unique_starts, unique_ends, start_positions, end_positions
+
+
+def get_xarray_coordinates(coordinates: List[Tuple[str, List]]) -> List[Tuple]:
+    """Coordinates with the time_intervals axis spread over plain int64 interval_start and interval_end dims"""
+    xarray_coordinates = []
+    for dim, values in coordinates:
+        if dim == "time_intervals":
+            unique_starts, unique_ends, _, _ = split_time_intervals(values)
+            xarray_coordinates.extend(zip(TIME_INTERVAL_DIMS, (unique_starts, unique_ends)))
+        else:
+            xarray_coordinates.append((dim, values))
+    return xarray_coordinates
+
+
+def get_time_interval_selection(coordinate_dict: Dict) -> Dict:
+    """`coordinate_dict` with its (start_ms, end_ms) time interval as interval_start and interval_end labels"""
+    selection = {dim: value for dim, value in coordinate_dict.items() if dim != "time_intervals"}
+    if "time_intervals" in coordinate_dict:
+        selection.update(zip(TIME_INTERVAL_DIMS, coordinate_dict["time_intervals"]))
+    return selection
 
 
 def time_interval_iterator_to_pd_multiindex(
@@ -15,3 +52,63 @@ def time_interval_iterator_to_pd_multiindex(
                                        list(set(end_list))],
                                       names=['start_time',
                                              'end_time'])
+
+
+class ResultTensor:
+    """
+    NaN-initialised float64 array per target over the full coordinate grid.
+    Results are addressed by integer positions and written in batches,
+    the xarray Dataset is only assembled at the end
+    """
+
+    def __init__(self,
+                 parameter_grid: ParameterGrid,
+                 targets: List[str],
+                 batch_size: int = 4096):
+        self.parameter_grid = parameter_grid
+        self.data = {target: np.full(parameter_grid.shape, np.nan, dtype=np.float64) for target in targets}
+        self.batch_size = batch_size
+        self._pending_positions = []
+        self._pending_results = []
+
+    def add(self,
+            position: Tuple[int, ...],
+            result_dict: Dict):
+        self._pending_positions.append(position)
+        self._pending_results.append(result_dict)
+        if len(self._pending_positions) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending_positions:
+            return
+        index = tuple(np.array(self._pending_positions, dtype=np.intp).T)
+        for target, target_data in self.data.items():
+            target_data[index] = np.array([np.nan if result.get(target) is None else result[target]
+                                           for result in self._pending_results],
+                                          dtype=np.float64)
+        self._pending_positions = []
+        self._pending_results = []
+
+    def spread_time_intervals(self,
+                              target_data: np.ndarray) -> np.ndarray:
+        time_axis = self.parameter_grid.dims.index("time_intervals")
+        unique_starts, unique_ends, start_positions, end_positions = \
+            split_time_intervals(self.parameter_grid.axis("time_intervals"))
+        spread_data = np.full(target_data.shape[:time_axis] + (len(unique_starts), len(unique_ends)) +
+                              target_data.shape[time_axis + 1:],
+                              np.nan,
+                              dtype=np.float64)
+        np.moveaxis(spread_data, (time_axis, time_axis + 1), (0, 1))[start_positions, end_positions] = \
+            np.moveaxis(target_data, time_axis, 0)
+        return spread_data
+
+    def to_dataset(self) -> xr.Dataset:
+        self.flush()
+        coordinates = get_xarray_coordinates(self.parameter_grid.coordinates)
+        if "time_intervals" in self.parameter_grid.dims:
+            data = {target: self.spread_time_intervals(target_data) for target, target_data in self.data.items()}
+        else:
+            data = self.data
+        return xr.Dataset({target: xr.DataArray(target_data, coords=coordinates)
+                           for target, target_data in data.items()})
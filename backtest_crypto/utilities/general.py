@@ -1,4 +1,5 @@
 import datetime
+import os
 from enum import Enum
 from dataclasses import dataclass
 from typing import Optional
@@ -67,3 +68,17 @@ class MissingPotentialCoinTimeIndexError(KeyError):
 class InsufficientBalance(ValueError):
     pass
 
+
+def datetime_to_ms(moment: datetime.datetime) -> int:
+    return int(round(moment.timestamp() * 1000))
+
+
+def ms_to_datetime(milliseconds) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(milliseconds / 1000)
+
+
+def get_usable_cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
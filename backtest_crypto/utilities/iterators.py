@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from typing import Union
 import numpy as np
 from crypto_history.stock_market.stock_market_factory import DateTimeOperations
+from backtest_crypto.utilities.general import datetime_to_ms, ms_to_datetime
 
 
 class TimeIntervalIterator:
@@ -74,29 +75,28 @@ class TimeIntervalIterator:
     def get_time_intervals_list(self):
         return list(self._get_time_intervals())
 
-    # TODO Should be made static
-    def get_list_time_intervals_str(self,
-                                    delimiter="_"):
-        time_intervals = self.time_intervals
-        # Made set because there could be multiple coordinates with the same values.
-        # Should probably be fixed in a better way
-        return list(set(map(
-            lambda x: f"{int(x[0].timestamp()*1000)}{delimiter}{int(x[1].timestamp()*1000)}", time_intervals
-            )
-        ))
+    def get_list_time_intervals_ms(self):
+        return sorted(set((datetime_to_ms(start), datetime_to_ms(end)) for start, end in self.time_intervals))
 
     @staticmethod
-    def get_datetime_objects_from_str(timestamps_separated,
-                                      delimiter="_"):
-        start, end = timestamps_separated.split(delimiter)
-        return datetime.fromtimestamp(float(start)/1000), datetime.fromtimestamp(float(end)/1000)
+    def get_datetime_objects_from_interval(time_interval):
+        start_ms, end_ms = time_interval
+        return ms_to_datetime(start_ms), ms_to_datetime(end_ms)
+
+    @staticmethod
+    def interval_to_str(time_interval,
+                        date_format="%d-%b-%Y"):
+        start, end = TimeIntervalIterator.get_datetime_objects_from_interval(time_interval)
+        return f"{start.strftime(date_format)} to {end.strftime(date_format)}"
 
     @classmethod
     def get_time_interval_list(cls,
                                time_interval_list):
-        time_intervals_datetime = list(map(cls.get_datetime_objects_from_str, time_interval_list))
-        _, end_list = zip(*time_intervals_datetime)
-        return list(map(lambda x: x.timestamp(), end_list))
+        # Datasets pickled before the intervals became int64 pairs hold "<ms>_<ms>" strings
+        if all(isinstance(item, str) for item in time_interval_list):
+            time_interval_list = [tuple(map(int, item.split("_"))) for item in time_interval_list]
+        _, end_list = zip(*time_interval_list)
+        return [end_ms / 1000 for end_ms in end_list]
 
     @staticmethod
     def numpy_dt_to_timedelta(numpy_dt):
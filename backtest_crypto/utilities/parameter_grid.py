@@ -0,0 +1,48 @@
+import itertools
+import math
+from typing import Dict, Iterator, List, Tuple
+
+
+class ParameterGrid:
+    """
+    Immutable cartesian grid of the gather coordinates, built once per gather.
+    Every combination is addressed by a tuple of integer positions, one per axis
+    """
+
+    def __init__(self,
+                 coordinates: List[Tuple[str, List]]):
+        self.dims = tuple(name for name, _ in coordinates)
+        self.axes = tuple(tuple(values) for _, values in coordinates)
+        self.shape = tuple(len(values) for values in self.axes)
+        self._axis_positions = tuple(dict(zip(values, range(len(values)))) for values in self.axes)
+        self._dim_index = dict(zip(self.dims, range(len(self.dims))))
+
+    def __len__(self):
+        return math.prod(self.shape)
+
+    @property
+    def coordinates(self) -> List[Tuple[str, List]]:
+        return [(dim, list(values)) for dim, values in zip(self.dims, self.axes)]
+
+    def axis(self,
+             dim: str) -> Tuple:
+        return self.axes[self._dim_index[dim]]
+
+    def position_on_axis(self,
+                         dim: str,
+                         value) -> int:
+        return self._axis_positions[self._dim_index[dim]][value]
+
+    def iter_indices(self,
+                     **fixed_positions: int) -> Iterator[Tuple[int, ...]]:
+        ranges = [(fixed_positions[dim],) if dim in fixed_positions else range(size)
+                  for dim, size in zip(self.dims, self.shape)]
+        return itertools.product(*ranges)
+
+    def coordinate_dict(self,
+                        indices: Tuple[int, ...]) -> Dict:
+        return {dim: values[index] for dim, values, index in zip(self.dims, self.axes, indices)}
+
+    def position(self,
+                 coordinate_dict: Dict) -> Tuple[int, ...]:
+        return tuple(positions[coordinate_dict[dim]] for dim, positions in zip(self.dims, self._axis_positions))
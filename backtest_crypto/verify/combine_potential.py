@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import pathlib
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+from backtest_crypto.verify.potential_shards import PotentialShardWriter
+from backtest_crypto.verify.potential_sqlite import SQLitePotentialStore
+from backtest_crypto.verify.potential_store import PotentialScoreStore
+
+logger = logging.getLogger(__name__)
+
+PotentialWindow = Tuple[int, int, Dict[str, float]]
+
+
+def iter_pickled_windows(pickled_potential_coin_path) -> Iterator[PotentialWindow]:
+    """Windows of a pickled potential Series, dropping the uncalculated ones, ordered by (start_ms, end_ms)"""
+    pickled_series = pd.read_pickle(pickled_potential_coin_path)
+    windows = [(*PotentialScoreStore.get_pair_key(history_start, history_end), value[0])
+               for (history_start, history_end), value in pickled_series.items()
+               if isinstance(value, list)]
+    del pickled_series
+    windows.sort(key=lambda window: window[:2])
+    return iter(windows)
+
+
+def iter_potential_windows(source_path) -> Iterator[PotentialWindow]:
+    """
+    Ordered windows of a potential source: a shard directory or a SQLite potential store
+    are streamed, a pickle has to be read whole
+    """
+    source_path = pathlib.Path(source_path)
+    if source_path.is_dir():
+        return PotentialShardWriter(source_path).iter_windows()
+    if SQLitePotentialStore.is_database_path(source_path):
+        return SQLitePotentialStore(source_path, read_only=True).iter_windows()
+    return iter_pickled_windows(source_path)
+
+
+def tag_windows(source_number: int,
+                window_iterator: Iterable[PotentialWindow]) -> Iterator[Tuple[int, int, int, Dict[str, float]]]:
+    for start_ms, end_ms, dict_of_all_coins in window_iterator:
+        yield start_ms, end_ms, source_number, dict_of_all_coins
+
+
+def merge_potential_windows(window_iterators: List[Iterable[PotentialWindow]]) -> Iterator[PotentialWindow]:
+    """
+    k-way merge of ordered window streams. When several sources hold the same (start, end)
+    window, the one from the source listed last wins
+    """
+    tagged_iterators = [tag_windows(source_number, window_iterator)
+                        for source_number, window_iterator in enumerate(window_iterators)]
+    merged = heapq.merge(*tagged_iterators, key=lambda window: window[:3])
+    for (start_ms, end_ms), duplicates in itertools.groupby(merged, key=lambda window: window[:2]):
+        *_, (_, _, _, dict_of_all_coins) = duplicates
+        yield start_ms, end_ms, dict_of_all_coins
+
+
+def write_potential_windows(potential_windows: Iterable[PotentialWindow],
+                            output_path,
+                            batch_size: int = 10000) -> int:
+    """
+    Writes ordered windows to `output_path`. A SQLite potential store is written in batches
+    as the windows arrive; any other path gets a pickle, which needs all windows in memory
+    """
+    potential_windows = iter(potential_windows)
+    window_count = 0
+    if SQLitePotentialStore.is_database_path(output_path):
+        potential_database = SQLitePotentialStore(output_path)
+        for batch in iter(lambda: list(itertools.islice(potential_windows, batch_size)), []):
+            potential_database.add_windows(batch)
+            window_count += len(batch)
+    else:
+        potential_store = PotentialScoreStore()
+        for start_ms, end_ms, dict_of_all_coins in potential_windows:
+            potential_store.add_pair(start_ms, end_ms, dict_of_all_coins)
+            window_count += 1
+        potential_store.to_series().to_pickle(output_path)
+    return window_count
+
+
+def combine_potential_coins(source_paths,
+                            output_path,
+                            batch_size: int = 10000) -> int:
+    """Merges potential pickles, shard directories and SQLite potential stores into `output_path`"""
+    merged_windows = merge_potential_windows([iter_potential_windows(source_path)
+                                              for source_path in source_paths])
+    window_count = write_potential_windows(merged_windows,
+                                           output_path,
+                                           batch_size)
+    logger.info(f"Combined {len(source_paths)} potential sources into {window_count} windows in {output_path}")
+    return window_count
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import datetime
+from typing import Callable, List
+
+import numpy as np
+
+from backtest_crypto.history_collect.price_matrix import PriceMatrix
+from backtest_crypto.utilities.general import datetime_to_ms
+
+
+class SimulationPriceWindow:
+    """
+    Simulation steps of one window mapped onto the rows of the price matrix, to find the next step
+    at which a price crosses a threshold or a moment has passed. Steps without a history row never
+    cross, as the per-step lookups treat them as missing history
+    """
+
+    def __init__(self,
+                 price_matrix: PriceMatrix,
+                 step_times: List[datetime.datetime]):
+        self.price_matrix = price_matrix
+        self.step_times = step_times
+        self.step_ms = np.fromiter((datetime_to_ms(step_time) for step_time in step_times),
+                                   dtype=np.int64,
+                                   count=len(step_times))
+        self.step_rows = np.searchsorted(price_matrix.timestamps, self.step_ms)
+        self._event_steps = {}
+
+    def __len__(self):
+        return len(self.step_ms)
+
+    def cached_event_step(self,
+                          key,
+                          from_step: int,
+                          search_function: Callable[..., int],
+                          *args) -> int:
+        """
+        `search_function(from_step, *args)`, reusing an earlier answer for the same `key` that has not been
+        reached yet: the prices do not change, so the first event after an earlier step that still lies
+        ahead is also the first event after `from_step`. `key` is kept alive so its id is not reused
+        """
+        cached = self._event_steps.get(id(key))
+        if cached is not None and cached[0] is key and cached[1] >= from_step:
+            return cached[1]
+        event_step = search_function(from_step, *args)
+        self._event_steps[id(key)] = (key, event_step)
+        return event_step
+
+    def get_step_of_row(self,
+                        row: int) -> int:
+        timestamps = self.price_matrix.timestamps
+        if row >= len(timestamps):
+            return len(self)
+        # A row between two steps is answered with the later step, which only costs a step without a fill
+        return int(np.searchsorted(self.step_ms, timestamps[row]))
+
+    def get_row_of_step(self,
+                        step: int) -> int:
+        return int(self.step_rows[step])
+
+    def first_crossing_step(self,
+                            from_step: int,
+                            coin: str,
+                            threshold: float,
+                            above: bool) -> int:
+        """First step at or after `from_step` with the price of `coin` >= `threshold` (<= when not `above`)"""
+        if from_step >= len(self):
+            return len(self)
+        return self.get_step_of_row(self.price_matrix.first_crossing_row(self.get_row_of_step(from_step),
+                                                                         self.price_matrix.coin_index[coin],
+                                                                         threshold,
+                                                                         above))
+
+    def first_step_after(self,
+                         from_step: int,
+                         moment: datetime.datetime) -> int:
+        """First step at or after `from_step` lying strictly after `moment`"""
+        return max(from_step, int(np.searchsorted(self.step_ms, datetime_to_ms(moment), side="right")))
+
+    def first_step_from(self,
+                        from_step: int,
+                        moment_ms: float) -> int:
+        """First step at or after `from_step` and at or after `moment_ms`, which may be infinite"""
+        return max(from_step, int(np.searchsorted(self.step_ms, moment_ms, side="left")))
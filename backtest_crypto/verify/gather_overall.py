@@ -1,17 +1,33 @@
+import collections
+import contextlib
+import datetime
 import itertools
 import logging
+import math
+import multiprocessing
+import pathlib
+import tempfile
 from abc import ABC, abstractmethod
-from typing import List
 from multiprocessing import Pool
+from typing import Dict, Iterator
 
+import numpy as np
 import xarray as xr
 
-from backtest_crypto.utilities.general import InsufficientHistory, MissingPotentialCoinTimeIndexError
+from backtest_crypto.history_collect.shared_history import SharedHistoryPublisher
+from backtest_crypto.utilities.data_structs import ResultTensor, get_time_interval_selection, get_xarray_coordinates
+from backtest_crypto.utilities.parameter_grid import ParameterGrid
+from backtest_crypto.utilities.general import InsufficientHistory, MissingPotentialCoinTimeIndexError, \
+    get_usable_cpu_count, datetime_to_ms, ms_to_datetime
 from backtest_crypto.verify.identify_potential_coins import CryptoOversoldCreator, PotentialCoinClient
+from backtest_crypto.verify.potential_shards import PotentialShardWriter
+from backtest_crypto.verify.potential_sqlite import SQLitePotentialStore
 from backtest_crypto.verify.individual_indicator_calculator import calculate_indicator
-from backtest_crypto.verify.simulate_timesteps import calculate_simulation_client
+from backtest_crypto.verify.simulate_timesteps import SELL_PARAMETERS, calculate_simulation_client, \
+    calculate_simulation_lanes_client
 
 logger = logging.getLogger(__name__)
+_worker_state = {}
 
 
 class GatherAbstract(ABC):
@@ -20,7 +36,11 @@ class GatherAbstract(ABC):
                  reference_coin,
                  ohlcv_field,
                  iterators,
-                 potential_coin_path=None
+                 potential_coin_path=None,
+                 pool_count=None,
+                 potential_calc_creator=None,
+                 compute_missing_potential=False,
+                 potential_staleness=datetime.timedelta(0)
                  ):
         self.reference_coin = reference_coin
         self.ohlcv_field = ohlcv_field
@@ -29,23 +49,36 @@ class GatherAbstract(ABC):
         self.source_iterators = iterators["source"]
         self.target_iterators = iterators["target"]
         self.strategy_iterators = iterators["strategy"]
-        self.do_not_sort_list = ["days_to_run"]
+        self.do_not_sort_list = ["days_to_run", "strategy"]
         self.full_history_da_dict = full_history_da_dict
         self.potential_coin_path = potential_coin_path
         self._potential_client = None
-        self.pool_count = 4
+        self._parameter_grid = None
+        self.pool_count = pool_count if pool_count is not None else get_usable_cpu_count()
+        self.potential_calc_creator = potential_calc_creator if potential_calc_creator is not None \
+            else CryptoOversoldCreator()
+        self.compute_missing_potential = compute_missing_potential
+        self.potential_staleness = potential_staleness
 
     @property
     def potential_client(self):
         if self._potential_client is None:
             self._potential_client = PotentialCoinClient(
                 self.time_interval_iterator,
-                CryptoOversoldCreator(),
+                self.potential_calc_creator,
                 self.full_history_da_dict,
                 self.potential_coin_path,
+                self.compute_missing_potential,
+                self.potential_staleness,
             )
         return self._potential_client
 
+    @property
+    def parameter_grid(self) -> ParameterGrid:
+        if self._parameter_grid is None:
+            self._parameter_grid = ParameterGrid(self.get_sorted_coords_for_dataset())
+        return self._parameter_grid
+
     @abstractmethod
     def get_coords_for_dataset(self):
         pass
@@ -56,17 +89,13 @@ class GatherAbstract(ABC):
             if key not in self.do_not_sort_list:
                 values.sort()
 
-    def get_tuple_strategy_wo_time_intervals(self):
+    def get_sorted_coords_for_dataset(self):
         coordinates = self.get_coords_for_dataset()
         self.sort_coordinates(coordinates)
-        strategic_items = []
-        non_ts_coordinates = [item for item in coordinates if item[0] != "time_intervals"]
-        for item in itertools.product(*(dict(non_ts_coordinates).values())):
-            strategic_items.append(item)
-        return strategic_items
+        return coordinates
 
     def initialize_success_dataarray(self):
-        return xr.DataArray(None, coords=self.get_coords_for_dataset())
+        return xr.DataArray(np.nan, coords=get_xarray_coordinates(self.get_coords_for_dataset()))
 
     def initialize_success_dataset(self):
         nan_da = self.initialize_success_dataarray()
@@ -75,104 +104,118 @@ class GatherAbstract(ABC):
             dataset[data_variable] = dataset[data_variable].copy()
         return dataset
 
-    def assemble_dynamic_arguments_for_pool(self,
-                                            time_interval,
-                                            narrowed_end_time,
-                                            narrowed_start_time
-                                            ):
-        tuple_strategy_list = self.get_tuple_strategy_wo_time_intervals()
-        collect_args = []
-        for tuple_strategy_wo_ts in tuple_strategy_list:
-            coordinate_dict = self.get_coordinate_dict(time_interval,
-                                                       tuple_strategy_wo_ts)
-            string_start_end = coordinate_dict['time_intervals']
-            history_start, history_end = self.time_interval_iterator.get_datetime_objects_from_str(
-                string_start_end
-            )
-            if narrowed_end_time >= history_end:
-                if history_end >= narrowed_start_time:
-                    collect_args.append(coordinate_dict)
-        return collect_args
-
-    def get_coordinate_dict(self,
-                            time_interval,
-                            tuple_strategy
-                            ):
-        coordinate_keys = dict(self.get_coords_for_dataset()).keys()
-        coordinate_dict = dict(zip(coordinate_keys,
-                                   (time_interval, *tuple_strategy)))
-        coordinate_dict['time_intervals'] = time_interval
-        return coordinate_dict
+    def is_time_interval_in_narrowed_range(self,
+                                           time_interval,
+                                           narrowed_end_time,
+                                           narrowed_start_time):
+        _, history_end_ms = time_interval
+        return datetime_to_ms(narrowed_end_time) >= history_end_ms >= datetime_to_ms(narrowed_start_time)
+
+    def get_task_indices(self,
+                         time_interval,
+                         narrowed_end_time,
+                         narrowed_start_time
+                         ):
+        if not self.is_time_interval_in_narrowed_range(time_interval,
+                                                       narrowed_end_time,
+                                                       narrowed_start_time):
+            return iter(())
+        time_position = self.parameter_grid.position_on_axis("time_intervals",
+                                                             time_interval)
+        return self.parameter_grid.iter_indices(time_intervals=time_position)
 
     def yield_time_intervals(self):
-        coordinates = self.get_coords_for_dataset()
-        self.sort_coordinates(coordinates)
-        time_intervals: List = dict(coordinates)['time_intervals']
-
-        first_item = None
-
-        for time_interval in time_intervals:
-            if first_item != time_interval:
-                try:
-                    history_start, history_end = self.time_interval_iterator.get_datetime_objects_from_str(
-                        time_interval
-                    )
-                    logger.info(f"Updating the first item: {history_start} to {history_end}")
-                except Exception:
-                    logger.info(f"Updating the first item: {time_interval}")
-                first_item = time_interval
+        for time_interval in self.parameter_grid.axis("time_intervals"):
+            logger.info(f"Updating the first item: {self.time_interval_iterator.interval_to_str(time_interval)}")
             yield time_interval
 
 
 class GatherPotential(GatherAbstract):
     def get_coords_for_dataset(self):
-        coordinates = [("time_intervals", self.time_interval_iterator.get_list_time_intervals_str())]
+        coordinates = [("time_intervals", self.time_interval_iterator.get_list_time_intervals_ms())]
         for success in self.success_iterators:
             coordinates.append((success.__name__, success()))
         for source in self.source_iterators:
             coordinates.append((source.__name__, source()))
         return coordinates
 
+    def get_narrowed_time_intervals(self,
+                                    narrowed_start_time,
+                                    narrowed_end_time):
+        return [time_interval for time_interval in self.parameter_grid.axis("time_intervals")
+                if self.is_time_interval_in_narrowed_range(time_interval,
+                                                           narrowed_end_time,
+                                                           narrowed_start_time)]
+
+    def yield_potential_windows(self,
+                                time_intervals):
+        """
+        Yields (time_interval, all-coin scores or None) with all windows of a start computed in one call,
+        spread over a process pool when there is more than one start
+        """
+        history_ends_per_start = {}
+        for start_ms, end_ms in time_intervals:
+            history_ends_per_start.setdefault(start_ms, []).append(end_ms)
+        tasks = list(history_ends_per_start.items())
+        potential_coin_strategy = {"ohlcv_field": self.ohlcv_field,
+                                   "reference_coin": self.reference_coin}
+        if self.pool_count <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield from compute_potential_windows(self.full_history_da_dict,
+                                                     self.potential_calc_creator,
+                                                     potential_coin_strategy,
+                                                     task)
+            return
+        with SharedHistoryPublisher(self.full_history_da_dict,
+                                    self.reference_coin,
+                                    self.ohlcv_field) as shared_history_handle:
+            with Pool(processes=min(self.pool_count, len(tasks)),
+                      initializer=initialize_potential_worker,
+                      initargs=(shared_history_handle,
+                                self.potential_calc_creator,
+                                potential_coin_strategy)) as pool:
+                for potential_windows in pool.imap_unordered(compute_potential_windows_in_worker,
+                                                             tasks):
+                    yield from potential_windows
+
+    def get_potential_identity(self) -> Dict[str, str]:
+        """What the stored potential scores depend on besides the time interval"""
+        creator_class = type(self.potential_calc_creator)
+        return {"creator": f"{creator_class.__module__}.{creator_class.__qualname__}",
+                "ohlcv_field": self.ohlcv_field,
+                "reference_coin": self.reference_coin}
+
     def store_potential_coins_pickled(self,
                                       narrowed_start_time,
                                       narrowed_end_time,
                                       pickled_file_path):
-        for time_interval in self.yield_time_intervals():
-            collected_args = self.assemble_dynamic_arguments_for_pool(time_interval,
-                                                    narrowed_end_time,
-                                                    narrowed_start_time)
-
-            for coordinate_dict in collected_args:
-                string_start_end = coordinate_dict["time_intervals"]
-
-                history_start, history_end = self.time_interval_iterator.get_datetime_objects_from_str(
-                    string_start_end
-                )
-                if narrowed_end_time >= history_end:
-                    if history_end >= narrowed_start_time:
-                        try:
-                            potential_coin_strategy = {**coordinate_dict,
-                                                       "ohlcv_field": self.ohlcv_field,
-                                                       "reference_coin": self.reference_coin}
-                            instance_potential_strategy = self.potential_client.\
-                                get_potential_strategy_tuple(potential_coin_strategy)
-                            self.potential_client.update_potential_coin_location(history_start,
-                                                                                 history_end,
-                                                                                 instance_potential_strategy,
-                                                                                 potential_coin_strategy)
-                        except InsufficientHistory:
-                            logger.warning(f"Insufficient history for {history_start} to {history_end}")
-            pandas_series = self.potential_client.get_complete_potential_coins_all_combinations()
-            pandas_series.to_pickle(pickled_file_path)
+        with PotentialShardWriter(f"{pickled_file_path}.shards",
+                                  self.get_potential_identity()) as shard_writer:
+            completed_intervals = shard_writer.completed_intervals
+            pending_intervals = [time_interval
+                                 for time_interval in self.get_narrowed_time_intervals(narrowed_start_time,
+                                                                                       narrowed_end_time)
+                                 if time_interval not in completed_intervals]
+            logger.info(f"{len(completed_intervals)} time intervals already stored, {len(pending_intervals)} to go")
+            for time_interval, dict_of_all_coins in self.yield_potential_windows(pending_intervals):
+                if dict_of_all_coins is None:
+                    logger.warning(f"Insufficient history for {self.time_interval_iterator.interval_to_str(time_interval)}")
+                shard_writer.submit(time_interval,
+                                    dict_of_all_coins)
+        shard_writer.compact(pickled_file_path)
 
 
 class GatherSimulation(GatherAbstract):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, sell_parameter_lanes=False, **kwargs):
         super(GatherSimulation, self).__init__(*args, **kwargs)
-        self.gathered_dataset = self.initialize_success_dataset()
+        # Simulate all SELL_PARAMETERS combinations of a task in one walk, see calculate_end_of_run_value_for_lanes
+        self.sell_parameter_lanes = sell_parameter_lanes
+        self.result_tensor = ResultTensor(self.parameter_grid,
+                                          self.target_iterators)
+        self.gathered_dataset = None
 
     def get_coords_for_dataset(self):
-        coordinates = [("time_intervals", self.time_interval_iterator.get_list_time_intervals_str()),
+        coordinates = [("time_intervals", self.time_interval_iterator.get_list_time_intervals_ms()),
                        ("strategy", list(strategy for strategy in self.strategy_iterators))]
         for success in self.success_iterators:
             coordinates.append((success.__name__, success()))
@@ -180,42 +223,203 @@ class GatherSimulation(GatherAbstract):
             coordinates.append((source.__name__, source()))
         return coordinates
 
-    def collect_arguments(self,
-                          time_interval,
-                          narrowed_start_time,
-                          narrowed_end_time,
-                          ):
-        collected_args = self.assemble_dynamic_arguments_for_pool(time_interval,
-                                                                  narrowed_end_time,
-                                                                  narrowed_start_time)
-        collected_args = [(self.ohlcv_field,
-                           item,
-                           self.potential_client,
-                           self.target_iterators,
-                           self.full_history_da_dict) for item in collected_args]
-        return collected_args
+    def get_chunksize(self,
+                      task_count):
+        # Roughly 4 chunks per worker keeps the tail of the sweep balanced
+        return max(1, math.ceil(task_count / (self.pool_count * 4)))
+
+    def get_simulation_pool(self,
+                            shared_history_handle,
+                            processes):
+        return Pool(processes,
+                    initializer=initialize_simulation_worker,
+                    initargs=(shared_history_handle,
+                              self.potential_client,
+                              self.ohlcv_field,
+                              self.target_iterators,
+                              self.parameter_grid))
+
+    def group_sell_parameter_lanes(self,
+                                   task_indices):
+        if not self.sell_parameter_lanes:
+            return [[indices] for indices in task_indices]
+        lane_positions = {position for position, dim in enumerate(self.parameter_grid.dims)
+                          if dim in SELL_PARAMETERS}
+        lane_groups = {}
+        for indices in task_indices:
+            shared_indices = tuple(index for position, index in enumerate(indices) if position not in lane_positions)
+            lane_groups.setdefault(shared_indices, []).append(indices)
+        return list(lane_groups.values())
+
+    def submit_simulation_batch(self,
+                                pool,
+                                task_indices):
+        """Lane groups chunked here rather than by the pool, whose chunked imap has no timeout on `next`"""
+        lane_groups = self.group_sell_parameter_lanes(task_indices)
+        chunksize = self.get_chunksize(len(lane_groups))
+        return pool.imap_unordered(execute_simulation_lane_chunk_in_worker,
+                                   [lane_groups[position:position + chunksize]
+                                    for position in range(0, len(lane_groups), chunksize)])
+
+    def collect_simulation_results(self,
+                                   lane_results_iterator,
+                                   timeout=None) -> bool:
+        """
+        Adds the results of a submitted batch to the result tensor as they arrive. With a `timeout`,
+        returns False once no result arrived within it and the batch is not finished yet
+        """
+        while True:
+            try:
+                lane_results = lane_results_iterator.next(timeout)
+            except StopIteration:
+                return True
+            except multiprocessing.TimeoutError:
+                return False
+            for indices, sim_result in itertools.chain.from_iterable(lane_results):
+                if sim_result is not None:
+                    self.result_tensor.add(indices,
+                                           sim_result)
+
+    def store_simulation_batch(self,
+                               pool,
+                               task_indices):
+        self.collect_simulation_results(self.submit_simulation_batch(pool,
+                                                                     task_indices))
 
     def simulation_calculator(self,
                               narrowed_start_time,
                               narrowed_end_time,
                               ):
+        task_indices = []
         for time_interval in self.yield_time_intervals():
-            collected_args = self.collect_arguments(time_interval,
-                                                    narrowed_start_time,
-                                                    narrowed_end_time)
-            with Pool(self.pool_count) as pool:
-                simulation_results = pool.starmap(self.execute_simulation, collected_args)
-
-            self.store_simulation_results(simulation_results,
-                                          collected_args)
+            task_indices.extend(self.get_task_indices(time_interval,
+                                                      narrowed_end_time,
+                                                      narrowed_start_time))
+        with SharedHistoryPublisher(self.full_history_da_dict,
+                                    self.reference_coin,
+                                    self.ohlcv_field) as shared_history_handle:
+            with self.get_simulation_pool(shared_history_handle,
+                                          self.pool_count) as pool:
+                self.store_simulation_batch(pool,
+                                            task_indices)
+        self.gathered_dataset = self.result_tensor.to_dataset()
         return self.gathered_dataset
 
-    def store_simulation_results(self,
-                                 simulation_results,
-                                 collected_args):
-        for sim_result, collected_arg in zip(simulation_results, collected_args):
-            self.set_simulator_in_dataset(sim_result,
-                                          collected_arg[1])
+    @contextlib.contextmanager
+    def pipeline_potential_database(self) -> Iterator[SQLitePotentialStore]:
+        """
+        The SQLite potential store of `potential_coin_path`. Without a path, a temporary database is used
+        for the duration of the pipelined simulation and removed afterwards
+        """
+        if self.potential_coin_path is not None:
+            if not SQLitePotentialStore.is_database_path(self.potential_coin_path):
+                raise ValueError(f"The pipelined simulation shares potential coins through SQLite, "
+                                 f"{self.potential_coin_path} is not a database path")
+            yield self.potential_client.potential_database
+            return
+        with tempfile.TemporaryDirectory(prefix="potential_") as temporary_directory:
+            self.potential_coin_path = str(pathlib.Path(temporary_directory) / "potential.db")
+            self._potential_client = None
+            logger.info(f"Storing the pipelined potential coins in {self.potential_coin_path}")
+            potential_database = self.potential_client.potential_database
+            try:
+                yield potential_database
+            finally:
+                potential_database.engine.dispose()
+                # The scores already read stay in the client's store, later starts are not looked up on disk
+                self.potential_client.potential_database = None
+                self.potential_coin_path = None
+                self._potential_client = None
+
+    def get_pending_potential_ends(self,
+                                   potential_database,
+                                   start_ms,
+                                   last_end_ms,
+                                   potential_window_interval):
+        window_ms = int(potential_window_interval.total_seconds() * 1000)
+        stored_ends = set(potential_database.get_window_ends(start_ms))
+        return [end_ms for end_ms in range(start_ms + window_ms, last_end_ms + 1, window_ms)
+                if end_ms not in stored_ends]
+
+    def pipelined_simulation_calculator(self,
+                                        narrowed_start_time,
+                                        narrowed_end_time,
+                                        potential_window_interval=datetime.timedelta(hours=1),
+                                        producer_count=None,
+                                        max_starts_ahead=None,
+                                        ):
+        """
+        Computes the potential coins while simulating, instead of reading a pickle made by an earlier run.
+        Producer processes score the windows of upcoming interval starts into the SQLite potential store
+        while the simulation processes run the tasks of starts whose windows are stored. At most
+        `max_starts_ahead` starts are scored ahead of the simulation, which bounds the memory.
+        Windows end every `potential_window_interval` after their start; for a coarser interval than
+        the candle, set `potential_staleness` so the simulation uses the latest stored window
+        """
+        with self.pipeline_potential_database() as potential_database:
+            task_indices_per_start = {}
+            last_end_per_start = {}
+            for time_interval in self.yield_time_intervals():
+                task_indices = list(self.get_task_indices(time_interval,
+                                                          narrowed_end_time,
+                                                          narrowed_start_time))
+                if task_indices:
+                    start_ms, end_ms = time_interval
+                    task_indices_per_start.setdefault(start_ms, []).extend(task_indices)
+                    last_end_per_start[start_ms] = max(end_ms, last_end_per_start.get(start_ms, end_ms))
+            producer_count = producer_count if producer_count is not None else max(1, self.pool_count // 4)
+            max_starts_ahead = max_starts_ahead if max_starts_ahead is not None else 2 * producer_count
+            potential_coin_strategy = {"ohlcv_field": self.ohlcv_field,
+                                       "reference_coin": self.reference_coin}
+            potential_tasks = iter([(start_ms, self.get_pending_potential_ends(potential_database,
+                                                                               start_ms,
+                                                                               last_end_ms,
+                                                                               potential_window_interval))
+                                    for start_ms, last_end_ms in last_end_per_start.items()])
+            with SharedHistoryPublisher(self.full_history_da_dict,
+                                        self.reference_coin,
+                                        self.ohlcv_field) as shared_history_handle:
+                with Pool(producer_count,
+                          initializer=initialize_potential_worker,
+                          initargs=(shared_history_handle,
+                                    self.potential_calc_creator,
+                                    potential_coin_strategy)) as producer_pool, \
+                        self.get_simulation_pool(shared_history_handle,
+                                                 max(1, self.pool_count - producer_count)) as simulation_pool:
+                    pending_starts = collections.deque()
+
+                    def submit_next_start():
+                        potential_task = next(potential_tasks, None)
+                        if potential_task is not None:
+                            pending_starts.append((potential_task[0],
+                                                   producer_pool.apply_async(compute_potential_windows_in_worker,
+                                                                             (potential_task,))))
+
+                    def collect_finished_batches(timeout):
+                        while running_batches and self.collect_simulation_results(running_batches[0],
+                                                                                  timeout):
+                            running_batches.popleft()
+
+                    for _ in range(max_starts_ahead):
+                        submit_next_start()
+                    running_batches = collections.deque()
+                    while pending_starts:
+                        start_ms, potential_result = pending_starts.popleft()
+                        while running_batches and not potential_result.ready():
+                            # Collect the simulations of earlier starts while the producers score this one
+                            collect_finished_batches(timeout=0.1)
+                        potential_database.add_windows((window_start_ms, window_end_ms, dict_of_all_coins)
+                                                       for (window_start_ms, window_end_ms), dict_of_all_coins
+                                                       in potential_result.get()
+                                                       if dict_of_all_coins is not None)
+                        submit_next_start()
+                        # Queued behind the running batches, so the simulation pool does not idle between starts
+                        running_batches.append(self.submit_simulation_batch(simulation_pool,
+                                                                            task_indices_per_start[start_ms]))
+                        collect_finished_batches(timeout=0)
+                    collect_finished_batches(timeout=None)
+        self.gathered_dataset = self.result_tensor.to_dataset()
+        return self.gathered_dataset
 
     @staticmethod
     def execute_simulation(ohlcv_field,
@@ -237,12 +441,97 @@ class GatherSimulation(GatherAbstract):
             # pass
             logger.warning(f"Insufficient history. Reason {e}")
 
-    def set_simulator_in_dataset(self,
-                                 simulate_result_dict,
-                                 success_input_dict
+    @staticmethod
+    def execute_simulation_lanes(ohlcv_field,
+                                 coordinate_dicts,
+                                 potential_client,
+                                 target_iterators,
+                                 full_history_da_dict
                                  ):
-        for simulate_criterion, success in simulate_result_dict.items():
-            self.gathered_dataset[simulate_criterion].loc[success_input_dict] = success
+        strategy = coordinate_dicts[0]["strategy"]()
+        for coordinate_dict in coordinate_dicts:
+            coordinate_dict.pop("strategy")
+        try:
+            return calculate_simulation_lanes_client(strategy,
+                                                     ohlcv_field=ohlcv_field,
+                                                     simulation_input_dicts=coordinate_dicts,
+                                                     potential_coin_client=potential_client,
+                                                     simulate_criteria=target_iterators,
+                                                     full_history_da_dict=full_history_da_dict
+                                                     )
+        except InsufficientHistory as e:
+            logger.warning(f"Insufficient history. Reason {e}")
+            return [None] * len(coordinate_dicts)
+
+
+def initialize_simulation_worker(shared_history_handle,
+                                 potential_client,
+                                 ohlcv_field,
+                                 target_iterators,
+                                 parameter_grid):
+    full_history_da_dict = shared_history_handle.attach()
+    for candle in full_history_da_dict.dataarray.keys():
+        full_history_da_dict.get_timestamps(candle)
+    potential_client.full_history_da_dict = full_history_da_dict
+    _worker_state.update(full_history_da_dict=full_history_da_dict,
+                         potential_client=potential_client,
+                         ohlcv_field=ohlcv_field,
+                         target_iterators=target_iterators,
+                         parameter_grid=parameter_grid)
+
+
+def compute_potential_windows(full_history_da_dict,
+                              potential_calc_creator,
+                              potential_coin_strategy,
+                              history_ends_per_start):
+    start_ms, end_ms_list = history_ends_per_start
+    history_ends = [ms_to_datetime(end_ms) for end_ms in end_ms_list]
+    dicts_of_all_coins = potential_calc_creator.get_dicts_of_all_coins(full_history_da_dict,
+                                                                       ms_to_datetime(start_ms),
+                                                                       history_ends,
+                                                                       potential_coin_strategy)
+    return [((start_ms, end_ms), dicts_of_all_coins.get(history_end))
+            for end_ms, history_end in zip(end_ms_list, history_ends)]
+
+
+def initialize_potential_worker(shared_history_handle,
+                                potential_calc_creator,
+                                potential_coin_strategy):
+    _worker_state.update(full_history_da_dict=shared_history_handle.attach(),
+                         potential_calc_creator=potential_calc_creator,
+                         potential_coin_strategy=potential_coin_strategy)
+
+
+def compute_potential_windows_in_worker(history_ends_per_start):
+    return compute_potential_windows(_worker_state["full_history_da_dict"],
+                                     _worker_state["potential_calc_creator"],
+                                     _worker_state["potential_coin_strategy"],
+                                     history_ends_per_start)
+
+
+def execute_simulation_in_worker(indices):
+    coordinate_dict = _worker_state["parameter_grid"].coordinate_dict(indices)
+    return indices, GatherSimulation.execute_simulation(_worker_state["ohlcv_field"],
+                                                        coordinate_dict,
+                                                        _worker_state["potential_client"],
+                                                        _worker_state["target_iterators"],
+                                                        _worker_state["full_history_da_dict"])
+
+
+def execute_simulation_lanes_in_worker(lane_indices):
+    if len(lane_indices) == 1:
+        return [execute_simulation_in_worker(lane_indices[0])]
+    coordinate_dicts = [_worker_state["parameter_grid"].coordinate_dict(indices) for indices in lane_indices]
+    return list(zip(lane_indices,
+                    GatherSimulation.execute_simulation_lanes(_worker_state["ohlcv_field"],
+                                                              coordinate_dicts,
+                                                              _worker_state["potential_client"],
+                                                              _worker_state["target_iterators"],
+                                                              _worker_state["full_history_da_dict"])))
+
+
+def execute_simulation_lane_chunk_in_worker(lane_groups):
+    return [execute_simulation_lanes_in_worker(lane_indices) for lane_indices in lane_groups]
 
 
 class GatherIndicator(GatherAbstract):
@@ -255,7 +544,7 @@ class GatherIndicator(GatherAbstract):
         self.gathered_dataset = self.initialize_success_dataset()
 
     def get_coords_for_dataset(self):
-        coordinates = [("time_intervals", self.time_interval_iterator.get_list_time_intervals_str()),
+        coordinates = [("time_intervals", self.time_interval_iterator.get_list_time_intervals_ms()),
                        ("strategy", list(strategy for strategy in self.strategy_iterators))]
         for success in self.success_iterators:
             coordinates.append((success.__name__, success()))
@@ -286,14 +575,12 @@ class GatherIndicator(GatherAbstract):
                                                 narrowed_start_time,
                                                 narrowed_end_time):
         for time_interval in self.yield_time_intervals():
-            collected_args = self.assemble_dynamic_arguments_for_pool(time_interval,
-                                                                      narrowed_end_time,
-                                                                      narrowed_start_time)
-
-            for coordinate_dict in collected_args:
-                string_start_end = coordinate_dict["time_intervals"]
-                history_start, history_end = self.time_interval_iterator.get_datetime_objects_from_str(
-                    string_start_end
+            for coordinate_dict in map(self.parameter_grid.coordinate_dict,
+                                       self.get_task_indices(time_interval,
+                                                             narrowed_end_time,
+                                                             narrowed_start_time)):
+                history_start, history_end = self.time_interval_iterator.get_datetime_objects_from_interval(
+                    coordinate_dict["time_intervals"]
                 )
                 if narrowed_end_time >= history_end:
                     if history_end >= narrowed_start_time:
@@ -329,5 +616,6 @@ class GatherIndicator(GatherAbstract):
     def set_indicator_in_dataset(self,
                                  success_dict,
                                  success_input_dict):
+        selection = get_time_interval_selection(success_input_dict)
         for success_criteria, success in success_dict.items():
-            self.gathered_dataset[success_criteria].loc[success_input_dict] = success
+            self.gathered_dataset[success_criteria].loc[selection] = success
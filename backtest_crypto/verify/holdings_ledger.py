@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backtest_crypto.utilities.general import HoldingCoin, InsufficientBalance, Order
+
+LockedSlot = Tuple[int, int, float, Order]
+
+
+class HoldingsLedger:
+    """
+    Holdings of one simulation as free and locked quantity arrays indexed by coin id, with a slot per order
+    locking a quantity. A coin has at most one free entry. Entries are kept in the order they were created,
+    which is the order the per-step code walks them in; iterating yields them as HoldingCoin snapshots,
+    which are reused until their entry changes
+    """
+
+    def __init__(self,
+                 base_assets: List[str],
+                 reference_coin: str):
+        self.reference_coin = reference_coin
+        self.coin_names = list(base_assets) + [reference_coin]
+        # The reference coin always takes the last id, it is priced at 1 rather than by its column
+        self.coin_index = {coin: coin_id for coin_id, coin in enumerate(self.coin_names)}
+        self.reference_id = self.coin_index[reference_coin]
+        self.free = np.zeros(len(self.coin_names), dtype=np.float64)
+        self.locked = np.zeros(len(self.coin_names), dtype=np.float64)
+        self.entries: Dict[int, Tuple[int, Optional[Order]]] = {}
+        self.coin_entries: Dict[int, Dict[int, Optional[Order]]] = {}
+        self.free_entries: Dict[int, int] = {}
+        self.locked_slots: Dict[int, LockedSlot] = {}
+        self.holding_views: Dict[int, HoldingCoin] = {}
+        self.next_entry = 0
+
+    def get_coin_id(self,
+                    coin_name: str) -> int:
+        try:
+            return self.coin_index[coin_name]
+        except KeyError:
+            coin_id = self.coin_index[coin_name] = len(self.coin_names)
+            self.coin_names.append(coin_name)
+            if coin_id == len(self.free):
+                # Doubled rather than grown by one, so coins missing from the price matrix are amortised O(1)
+                self.free = np.concatenate([self.free, np.zeros_like(self.free)])
+                self.locked = np.concatenate([self.locked, np.zeros_like(self.locked)])
+            return coin_id
+
+    def _add_entry(self,
+                   coin_id: int,
+                   order: Optional[Order]) -> int:
+        entry = self.next_entry
+        self.next_entry += 1
+        self.entries[entry] = (coin_id, order)
+        self.coin_entries.setdefault(coin_id, {})[entry] = order
+        return entry
+
+    def _replace_entry(self,
+                       entry: int,
+                       order: Optional[Order]):
+        coin_id, _ = self.entries[entry]
+        self.entries[entry] = (coin_id, order)
+        self.coin_entries[coin_id][entry] = order
+        self.holding_views.pop(entry, None)
+
+    def _remove_entry(self,
+                      entry: int):
+        coin_id, _ = self.entries.pop(entry)
+        del self.coin_entries[coin_id][entry]
+        self.holding_views.pop(entry, None)
+
+    def _set_free(self,
+                  coin_id: int,
+                  quantity: float):
+        self.free[coin_id] = quantity
+        self.holding_views.pop(self.free_entries.get(coin_id), None)
+
+    def _drop_locked(self,
+                     coin_id: int,
+                     quantity: float):
+        if len(self.coin_entries[coin_id]) == (coin_id in self.free_entries):
+            # Reset instead of subtracting, so that rounding does not accumulate once nothing is locked
+            self.locked[coin_id] = 0.0
+        else:
+            self.locked[coin_id] -= quantity
+
+    def _get_holding(self,
+                     entry: int) -> HoldingCoin:
+        try:
+            return self.holding_views[entry]
+        except KeyError:
+            pass
+        coin_id, order = self.entries[entry]
+        quantity = float(self.free[coin_id]) if order is None else self.locked_slots[id(order)][2]
+        holding = self.holding_views[entry] = HoldingCoin(coin_name=self.coin_names[coin_id],
+                                                          quantity=quantity,
+                                                          order_instance=order)
+        return holding
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[HoldingCoin]:
+        for entry in list(self.entries):
+            if entry in self.entries:
+                yield self._get_holding(entry)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def get_coin_names(self) -> List[str]:
+        return [self.coin_names[coin_id] for coin_id, _ in self.entries.values()]
+
+    def count_entries(self,
+                      coin_name: str) -> int:
+        return len(self.coin_entries.get(self.coin_index.get(coin_name), ()))
+
+    def get_free_quantity(self,
+                          coin_name: str) -> float:
+        coin_id = self.coin_index.get(coin_name)
+        if coin_id is None or coin_id not in self.free_entries:
+            return 0
+        return float(self.free[coin_id])
+
+    def get_first_quantity(self,
+                           coin_name: str) -> float:
+        """Quantity of the oldest entry of the coin, free or locked"""
+        coin_entries = self.coin_entries.get(self.coin_index.get(coin_name))
+        if not coin_entries:
+            raise InsufficientBalance("Coin not in the list")
+        entry = next(iter(coin_entries))
+        return self._get_holding(entry).quantity
+
+    def add_free(self,
+                 coin_name: str,
+                 quantity: float):
+        coin_id = self.get_coin_id(coin_name)
+        if coin_id in self.free_entries:
+            self._set_free(coin_id, self.free[coin_id] + quantity)
+        else:
+            self.free_entries[coin_id] = self._add_entry(coin_id, None)
+            self.free[coin_id] = quantity
+
+    def add_locked(self,
+                   coin_name: str,
+                   quantity: float,
+                   order: Order):
+        coin_id = self.get_coin_id(coin_name)
+        self.locked_slots[id(order)] = (self._add_entry(coin_id, order), coin_id, quantity, order)
+        self.locked[coin_id] += quantity
+
+    def lock(self,
+             coin_name: str,
+             quantity: float,
+             order: Order,
+             tolerance: float):
+        """
+        Moves `quantity` of the free entry into a slot of `order`. A free entry within `tolerance` of
+        `quantity` is locked whole and keeps its place
+        """
+        coin_id = self.coin_index.get(coin_name)
+        if coin_id not in self.free_entries:
+            raise InsufficientBalance(f"Could not lock {order} as the holdings are only {self}")
+        free_quantity = float(self.free[coin_id])
+        difference = free_quantity - quantity
+        if abs(difference) < tolerance:
+            entry = self.free_entries.pop(coin_id)
+            self.free[coin_id] = 0.0
+            self._replace_entry(entry, order)
+            self.locked_slots[id(order)] = (entry, coin_id, free_quantity, order)
+            self.locked[coin_id] += free_quantity
+        else:
+            self._set_free(coin_id, difference)
+            self.add_locked(coin_name, quantity, order)
+
+    def release(self,
+                order: Order) -> float:
+        """Removes the slot of `order` and returns its quantity"""
+        try:
+            entry, coin_id, quantity, _ = self.locked_slots.pop(id(order))
+        except KeyError:
+            raise InsufficientBalance(f"Did not have {order} to remove from holdings {self}")
+        self._remove_entry(entry)
+        self._drop_locked(coin_id, quantity)
+        return quantity
+
+    def unlock_in_place(self,
+                        order: Order):
+        """Turns the slot of `order` back into the free entry of its coin, keeping its place"""
+        entry, coin_id, quantity, _ = self.locked_slots[id(order)]
+        if coin_id in self.free_entries:
+            self.release(order)
+            self.add_free(self.coin_names[coin_id], quantity)
+            return
+        del self.locked_slots[id(order)]
+        self._replace_entry(entry, None)
+        self.free_entries[coin_id] = entry
+        self.free[coin_id] = quantity
+        self._drop_locked(coin_id, quantity)
+
+    def discard(self,
+                holding: HoldingCoin):
+        """Drops the free entry `holding` was read from. A locked entry goes with its order, release it instead"""
+        if holding.order_instance is not None:
+            raise ValueError(f"{holding} is locked by an open order and cannot be discarded")
+        coin_id = self.coin_index[holding.coin_name]
+        self._remove_entry(self.free_entries.pop(coin_id))
+        self.free[coin_id] = 0.0
+
+    def get_total_worth(self,
+                        price_row: np.ndarray) -> float:
+        """Worth in the reference coin at a price matrix row, 0 when a held coin has no price"""
+        prices = np.full(len(self.free), np.nan)
+        prices[:len(price_row)] = price_row
+        prices[self.reference_id] = 1
+        held = np.zeros(len(self.free), dtype=bool)
+        held[[coin_id for coin_id, coin_entries in self.coin_entries.items() if coin_entries]] = True
+        held_prices = prices[held]
+        if np.isnan(held_prices).any():
+            return 0
+        return float(np.dot(self.free[held] + self.locked[held], held_prices))
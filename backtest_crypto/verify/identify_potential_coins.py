@@ -3,48 +3,43 @@ from __future__ import annotations
 import logging
 import pandas as pd
 import datetime
-import math
+import numpy as np
+import xarray as xr
 from abc import ABC, abstractmethod
+import functools
+import math
 from collections import namedtuple
 from datetime import timedelta
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 
 
 from crypto_oversold.core_calc import candle_independent, normalize_by_all_tickers, preprocess_oversold_calc
 
-from backtest_crypto.history_collect.gather_history import get_merged_history, get_simple_history
-from backtest_crypto.utilities.data_structs import time_interval_iterator_to_pd_multiindex
-from backtest_crypto.utilities.general import InsufficientHistory, MissingPotentialCoinTimeIndexError
+from backtest_crypto.history_collect.gather_history import get_merged_history, get_candle_width_ms
+from backtest_crypto.utilities.general import InsufficientHistory, MissingPotentialCoinTimeIndexError, \
+    datetime_to_ms
+from backtest_crypto.verify.oversold_scores import time_weighted_oversold_scores, scores_to_dicts, \
+    IncrementalOversoldScorer
+from backtest_crypto.verify.potential_store import PotentialScoreStore
+from backtest_crypto.verify.potential_sqlite import SQLitePotentialStore
 
 logger = logging.getLogger(__name__)
 
 
 class PotentialNamedTuple:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_tuple_class(field_names: Tuple[str, ...]):
+        return namedtuple('PotentialCoin',
+                          field_names
+                          )
+
     @staticmethod
     def get_tuple_instance(**potential_coin_strategy):
-        potential_coin = namedtuple('PotentialCoin',
-                                    list(potential_coin_strategy.keys())
-                                    )
+        potential_coin = PotentialNamedTuple.get_tuple_class(tuple(potential_coin_strategy.keys()))
         return potential_coin(**potential_coin_strategy)
 
 
-class MultiIndexPotential(pd.DataFrame):
-    @classmethod
-    def load_pickled(cls,
-                     pickled_potential_coin_path,
-                     ):
-        pickled_series = pd.read_pickle(pickled_potential_coin_path)
-        df = cls(pickled_series)
-        df["potential"] = None
-        return df
-
-    @classmethod
-    def initialize_series(cls,
-                          time_interval_iterator):
-        return cls(index=time_interval_iterator_to_pd_multiindex(time_interval_iterator),
-                   columns=["all", "potential"])
-
-
 class PotentialCoinClient:
     _shared_state = {}
 
@@ -53,56 +48,56 @@ class PotentialCoinClient:
                  potential_calc_creator: AbstractIdentifyCreator,
                  full_history_da_dict,
                  pickled_potential_coin_path=None,
+                 compute_missing_potential=False,
+                 potential_staleness: timedelta = timedelta(0),
                  ):
         self.__dict__ = self._shared_state
         if pickled_potential_coin_path is not None:
-            self.multi_index_df = MultiIndexPotential.load_pickled(pickled_potential_coin_path)
+            if SQLitePotentialStore.is_database_path(pickled_potential_coin_path):
+                # Windows are read from the database per start, the first time they are asked for
+                self.potential_database = SQLitePotentialStore(pickled_potential_coin_path)
+                self.potential_store = PotentialScoreStore()
+            else:
+                self.potential_database = None
+                self.potential_store = PotentialScoreStore.load_pickled(pickled_potential_coin_path)
+            self.loaded_potential_starts = set()
         if not self._shared_state:
-            self.multi_index_df = MultiIndexPotential.initialize_series(time_interval_iterator)
+            self.potential_database = None
+            self.potential_store = PotentialScoreStore()
+            self.loaded_potential_starts = set()
         self.potential_calc_creator = potential_calc_creator
         self.full_history_da_dict = full_history_da_dict
+        self.compute_missing_potential = compute_missing_potential
+        self.potential_staleness_ms = int(potential_staleness.total_seconds() * 1000)
+        self.incremental_scorers = {}
 
-    def does_potential_coin_exist_in_object(self,
-                                            history_start,
-                                            history_end,
-                                            potential_coin):
-        if pd.isnull(
-                self.multi_index_df["potential"][history_start, history_end]
-        ):
-            if isinstance(self.multi_index_df["potential"][history_start, history_end], list):
-                return potential_coin in self.multi_index_df["potential"][history_start][history_end][0].keys()
-        return False
+    def __getstate__(self):
+        # The history is published to worker processes separately, see SharedHistoryPublisher
+        state = self.__dict__.copy()
+        state["full_history_da_dict"] = None
+        state["incremental_scorers"] = {}
+        return state
 
     def filter_potential(self,
-                         original_dict: Dict,
+                         history_start,
+                         history_end,
                          potential_coin_strategy: Dict,
                          ) -> Dict:
         lower_cutoff, higher_cutoff = self.get_low_high_cutoff(potential_coin_strategy)
-        return dict(filter(lambda x: lower_cutoff < x[1] < higher_cutoff, original_dict.items()))
+        return self.potential_store.filter_potential(history_start,
+                                                     history_end,
+                                                     lower_cutoff,
+                                                     higher_cutoff)
 
     def update_potential_coin_location(self,
                                        history_start,
                                        history_end,
                                        potential_coin,
                                        potential_coin_strategy):
-        if pd.isnull(
-                self.multi_index_df["all"][history_start, history_end]
-        ):
+        if (history_start, history_end) not in self.potential_store:
             self.update_potential_value_for_all_coins(history_start,
                                                       history_end,
                                                       potential_coin_strategy)
-        all_coins_dict = self.multi_index_df["all"][history_start, history_end][0]
-
-        dict_of_potential_coins = self.filter_potential(all_coins_dict,
-                                                        potential_coin_strategy)
-
-        if isinstance(self.multi_index_df["potential"][history_start, history_end], list):
-            self.multi_index_df["potential"][history_start, history_end][0].update(
-                {potential_coin: dict_of_potential_coins}
-            )
-        else:
-            self.multi_index_df["potential"][history_start, history_end] = [
-                {potential_coin: dict_of_potential_coins}]
 
     @staticmethod
     def get_low_high_cutoff(potential_coin_strategy: Dict) -> Tuple[float, float]:
@@ -131,36 +126,128 @@ class PotentialCoinClient:
                               consider_history,
                               potential_coin_strategy,
                               ):
-        instance_potential_strategy = self.get_potential_strategy_tuple(potential_coin_strategy)
+        potential_coins = self.get_potential_coin_as_of(consider_history,
+                                                        potential_coin_strategy)
+        if potential_coins is None:
+            raise MissingPotentialCoinTimeIndexError
+        return potential_coins
+
+    def get_potential_coin_as_of(self,
+                                 consider_history,
+                                 potential_coin_strategy,
+                                 ) -> Optional[Dict]:
+        """
+        Potential coins of the latest stored window of the same start ending at most `potential_staleness`
+        before the requested end. None when there is no such window and it cannot be computed
+        """
+        history_start, history_end = consider_history
+        self.ensure_potential_start_loaded(history_start)
+        pair_key = self.potential_store.get_as_of_key(history_start,
+                                                      history_end,
+                                                      self.potential_staleness_ms)
+        if pair_key is None:
+            if not self.compute_missing_potential:
+                return None
+            try:
+                self.update_missing_potential_value(history_start,
+                                                    history_end,
+                                                    potential_coin_strategy)
+            except MissingPotentialCoinTimeIndexError:
+                return None
+            pair_key = self.potential_store.get_pair_key(history_start,
+                                                         history_end)
+        return self.filter_potential(*pair_key,
+                                     potential_coin_strategy)
+
+    def get_next_stored_end(self,
+                            history_start,
+                            history_end) -> Optional[int]:
+        """End in ms of the first stored window of the same start after `history_end`, None when there is none"""
+        self.ensure_potential_start_loaded(history_start)
+        return self.potential_store.get_next_end(history_start,
+                                                 history_end)
+
+    def get_potential_coins_for_cutoffs(self,
+                                        consider_history,
+                                        cutoff_pairs: List[Tuple[float, float]]) -> List[Dict]:
+        """Potential coins for a whole vector of (low_cutoff, high_cutoff) bands of one history pair"""
         history_start, history_end = consider_history
-        try:
-            all_coin_values = self.multi_index_df['all'][history_start, history_end]
-            if isinstance(all_coin_values, float):
-                if math.isnan(all_coin_values):
-                    raise MissingPotentialCoinTimeIndexError
-        except KeyError as e:
+        self.ensure_potential_start_loaded(history_start)
+        if consider_history not in self.potential_store:
             raise MissingPotentialCoinTimeIndexError
-        if not self.does_potential_coin_exist_in_object(history_start,
-                                                        history_end,
-                                                        instance_potential_strategy):
-            self.update_potential_coin_location(history_start,
-                                                history_end,
-                                                instance_potential_strategy,
-                                                potential_coin_strategy)
-        return self.multi_index_df["potential"][history_start, history_end][0][instance_potential_strategy]
+        lower_cutoffs, higher_cutoffs = zip(*cutoff_pairs) if cutoff_pairs else ((), ())
+        return self.potential_store.filter_potential_batch(history_start,
+                                                           history_end,
+                                                           lower_cutoffs,
+                                                           higher_cutoffs)
 
     def get_complete_potential_coins_all_combinations(self):
-        return self.multi_index_df["all"]
+        return self.potential_store.to_series()
 
     def update_potential_value_for_all_coins(self,
                                              start_time,
                                              end_time,
                                              potential_coin_strategy):
-        self.multi_index_df["all"][start_time, end_time] = [
-            self.get_dictionary_of_all_coins_fresh(start_time,
-                                                   end_time,
-                                                   potential_coin_strategy)
-        ]
+        self.potential_store.add_pair(start_time,
+                                      end_time,
+                                      self.get_dictionary_of_all_coins_fresh(start_time,
+                                                                             end_time,
+                                                                             potential_coin_strategy))
+
+    def update_potential_values_for_windows(self,
+                                            history_start,
+                                            history_ends: List,
+                                            potential_coin_strategy):
+        missing_ends = [history_end for history_end in history_ends
+                        if (history_start, history_end) not in self.potential_store]
+        if not missing_ends:
+            return
+        dicts_of_all_coins = self.potential_calc_creator.get_dicts_of_all_coins(self.full_history_da_dict,
+                                                                                history_start,
+                                                                                missing_ends,
+                                                                                potential_coin_strategy)
+        for history_end, dict_of_all_coins in dicts_of_all_coins.items():
+            self.potential_store.add_pair(history_start,
+                                          history_end,
+                                          dict_of_all_coins)
+
+    def ensure_potential_start_loaded(self,
+                                      history_start):
+        if self.potential_database is None or history_start in self.loaded_potential_starts:
+            return
+        self.potential_store.update(self.potential_database.load_start(history_start))
+        self.loaded_potential_starts.add(history_start)
+
+    def update_missing_potential_value(self,
+                                       history_start,
+                                       history_end,
+                                       potential_coin_strategy):
+        """
+        Scores a window missing from the store, by moving the start's incremental scorer on when the creator
+        has one (`ApproximateOversoldCreator`) and from scratch otherwise (`CryptoOversoldCreator`)
+        """
+        if history_start not in self.incremental_scorers:
+            self.incremental_scorers[history_start] = self.potential_calc_creator.get_incremental_scorer(
+                self.full_history_da_dict,
+                history_start,
+                potential_coin_strategy
+            )
+        scorer = self.incremental_scorers[history_start]
+        if scorer is None:
+            # The creator only scores windows from scratch
+            try:
+                self.update_potential_value_for_all_coins(history_start,
+                                                          history_end,
+                                                          potential_coin_strategy)
+            except InsufficientHistory:
+                raise MissingPotentialCoinTimeIndexError
+            return
+        scorer.advance_to(datetime_to_ms(history_end))
+        if scorer.window_length == 0:
+            raise MissingPotentialCoinTimeIndexError
+        self.potential_store.add_pair(history_start,
+                                      history_end,
+                                      scorer.get_score_dict())
 
     def get_dictionary_of_all_coins_fresh(self,
                                           start_time,
@@ -190,12 +277,41 @@ class AbstractIdentifyCreator(ABC):
                                                         history_end,
                                                         potential_coin_strategy)
 
+    def get_dicts_of_all_coins(self,
+                               full_history_da_dict,
+                               history_start,
+                               history_ends: List,
+                               potential_coin_strategy,
+                               ) -> Dict:
+        concrete = self.factory_method(full_history_da_dict)
+        return concrete.get_potential_dicts_of_all_coins(history_start,
+                                                         history_ends,
+                                                         potential_coin_strategy)
+
+    def get_incremental_scorer(self,
+                               full_history_da_dict,
+                               history_start,
+                               potential_coin_strategy,
+                               ):
+        concrete = self.factory_method(full_history_da_dict)
+        return concrete.get_incremental_scorer(history_start,
+                                               potential_coin_strategy)
+
 
 class CryptoOversoldCreator(AbstractIdentifyCreator):
     def factory_method(self, *args, **kwargs):
         return ConcreteCryptoOversoldIdentify(*args, **kwargs)
 
 
+class ApproximateOversoldCreator(AbstractIdentifyCreator):
+    """
+    Opt-in, scores windows with the running-sum approximation of `time_weighted_oversold_scores` instead of
+    the crypto_oversold pipeline. Check `get_potential_divergence` before swapping it for `CryptoOversoldCreator`
+    """
+    def factory_method(self, *args, **kwargs):
+        return ConcreteApproximateOversoldIdentify(*args, **kwargs)
+
+
 class AbstractConcreteIdentify(ABC):
     def __init__(self,
                  full_history_da_dict,
@@ -207,8 +323,37 @@ class AbstractConcreteIdentify(ABC):
     def all_coins_potential_at_history_end(self, *args, **kwargs):
         raise NotImplementedError
 
+    @abstractmethod
+    def get_potential_dict_of_all_coins(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_potential_dicts_of_all_coins(self,
+                                         history_start,
+                                         history_ends: List,
+                                         potential_coin_strategy) -> Dict:
+        """All-coin scores per history end. Ends without sufficient history are left out"""
+        dicts_of_all_coins = {}
+        for history_end in history_ends:
+            try:
+                dicts_of_all_coins[history_end] = self.get_potential_dict_of_all_coins(history_start,
+                                                                                       history_end,
+                                                                                       potential_coin_strategy)
+            except InsufficientHistory:
+                logger.warning(f"Insufficient history for {history_start} to {history_end}")
+        return dicts_of_all_coins
+
+    def get_incremental_scorer(self,
+                               history_start,
+                               potential_coin_strategy):
+        """None when the scores of a growing window cannot be updated incrementally"""
+        return None
+
 
 class ConcreteCryptoOversoldIdentify(AbstractConcreteIdentify):
+    backward_details = ((timedelta(days=0), -timedelta(days=2), "1h"),)
+    remaining = "1d"
+    coin_drop_fraction = 0.975
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -222,6 +367,108 @@ class ConcreteCryptoOversoldIdentify(AbstractConcreteIdentify):
 
         return self.ds_to_dict(dataset=ds)
 
+    def get_potential_dicts_of_all_coins(self,
+                                         history_start,
+                                         history_ends: List,
+                                         potential_coin_strategy) -> Dict:
+        """
+        All-coin scores per history end, ends without sufficient history are left out. The history of every
+        candle is reformatted for crypto_oversold once, over the rows of all the windows, and each end takes
+        its rows of it. The reformat keeps all coins then; the coins with fewer than `coin_drop_fraction`
+        of the rows of a window are dropped per end instead
+        """
+        ohlcv_field = potential_coin_strategy["ohlcv_field"]
+        merged_ranges = {history_end: self.full_history_da_dict.get_merged_ranges(history_start,
+                                                                                  history_end,
+                                                                                  self.backward_details,
+                                                                                  self.remaining)
+                         for history_end in history_ends}
+        reformatted_histories = self.get_reformatted_histories(merged_ranges.values())
+        dicts_of_all_coins = {}
+        for history_end, sub_ranges in merged_ranges.items():
+            try:
+                pre_processed_da = self.get_pre_processed_window(reformatted_histories,
+                                                                 sub_ranges,
+                                                                 ohlcv_field)
+            except InsufficientHistory:
+                logger.warning(f"Insufficient history for {history_start} to {history_end}")
+                continue
+            dicts_of_all_coins[history_end] = self.ds_to_dict(self.score_pre_processed_history(pre_processed_da,
+                                                                                               ohlcv_field,
+                                                                                               history_start,
+                                                                                               history_end))
+        return dicts_of_all_coins
+
+    def get_reformatted_histories(self,
+                                  sub_ranges_list) -> Dict:
+        """Per candle, its history over the rows of all the windows in the layout crypto_oversold computes on"""
+        row_bounds = {}
+        for sub_ranges in sub_ranges_list:
+            for candle, lower, upper in sub_ranges:
+                if lower < upper:
+                    lowest, highest = row_bounds.get(candle, (lower, upper))
+                    row_bounds[candle] = (min(lowest, lower), max(highest, upper))
+        pre_processed_instance = preprocess_oversold_calc. \
+            ReformatForOversoldCalc(exchange=self.data_source_specific,
+                                    coin_drop_fraction=0)
+        return {candle: pre_processed_instance.get_dataarray_for_oversold_calc(
+                    self.attach_weight_plane(self.full_history_da_dict.get_candle_history(candle, lower, upper)))
+                for candle, (lower, upper) in row_bounds.items()}
+
+    def get_pre_processed_window(self,
+                                 reformatted_histories: Dict,
+                                 sub_ranges,
+                                 ohlcv_field):
+        """The rows of one window from the reformatted histories, without the coins short of history in it"""
+        sub_histories = []
+        valid_count = pd.Series(dtype=np.int64)
+        row_count = 0
+        for candle, lower, upper in sub_ranges:
+            if lower >= upper:
+                continue
+            timestamps = self.full_history_da_dict.get_timestamps(candle)
+            reformatted_timestamps = reformatted_histories[candle].timestamp.values
+            sub_histories.append(reformatted_histories[candle].isel(timestamp=slice(
+                np.searchsorted(reformatted_timestamps, timestamps[lower], side="left"),
+                np.searchsorted(reformatted_timestamps, timestamps[upper - 1], side="right")
+            )))
+            price_matrix = self.full_history_da_dict.get_price_matrix(candle, ohlcv_field)
+            valid_count = valid_count.add(pd.Series(price_matrix.cumulative_valid_count[upper] -
+                                                    price_matrix.cumulative_valid_count[lower],
+                                                    index=price_matrix.base_assets),
+                                          fill_value=0)
+            row_count += upper - lower
+        if not sub_histories:
+            raise InsufficientHistory
+        window = xr.concat(sub_histories, dim="timestamp")
+        if not self.full_history_da_dict.are_ranges_disjoint(sub_ranges):
+            window = window.sortby("timestamp")
+        sufficient_coins = valid_count.index[valid_count >= self.coin_drop_fraction * row_count]
+        return window.isel(base_assets=np.flatnonzero(np.isin(window.base_assets.values, sufficient_coins)))
+
+    def get_incremental_scorer(self,
+                               history_start,
+                               potential_coin_strategy):
+        """
+        None, the window statistics are computed inside crypto_oversold and the merged window changes its
+        candles as the end moves, so they cannot be rolled forward exactly
+        """
+        return None
+
+    def attach_weight_plane(self,
+                            history):
+        """
+        crypto_oversold reads the candle of every row from a "weight" field, which is built here from the
+        float `weight` coordinate of the history rather than kept in it
+        """
+        candle_names = {get_candle_width_ms(candle): candle for candle in self.full_history_da_dict.dataarray}
+        row_candles = np.array([candle_names[width] for width in history.weight.values.tolist()], dtype=object)
+        weight_field = history.isel(ohlcv_fields=[0]).drop_vars("weight")
+        weight_field = weight_field.copy(data=np.broadcast_to(row_candles[:, np.newaxis],
+                                                              weight_field.shape).copy())
+        return xr.concat([history.drop_vars("weight"), weight_field.assign_coords(ohlcv_fields=["weight"])],
+                         dim="ohlcv_fields")
+
     @staticmethod
     def ds_to_dict(dataset):
         if 0 in dataset.dims.values():
@@ -237,22 +484,31 @@ class ConcreteCryptoOversoldIdentify(AbstractConcreteIdentify):
         available_da = get_merged_history(self.full_history_da_dict,
                                           history_start,
                                           history_end,
-                                          backward_details=((timedelta(days=0), -timedelta(days=2), "1h"),),
-                                          remaining="1d")
+                                          backward_details=self.backward_details,
+                                          remaining=self.remaining)
 
         if available_da.timestamp.__len__() == 0:
             raise InsufficientHistory
-
-        ohlcv_field = potential_coin_strategy["ohlcv_field"]
-        normalized_field = f"{ohlcv_field}_normalized_by_weight"
+        available_da = self.attach_weight_plane(available_da)
 
         pre_processed_instance = preprocess_oversold_calc. \
             ReformatForOversoldCalc(exchange=self.data_source_specific,
-                                    coin_drop_fraction=0.975)
+                                    coin_drop_fraction=self.coin_drop_fraction)
 
         pre_processed_da = pre_processed_instance.get_dataarray_for_oversold_calc(available_da)
 
         logger.debug(f"The dataarray in the unmasked history has been pre-processed for {history_start} {history_end}")
+        return self.score_pre_processed_history(pre_processed_da,
+                                                potential_coin_strategy["ohlcv_field"],
+                                                history_start,
+                                                history_end)
+
+    def score_pre_processed_history(self,
+                                    pre_processed_da,
+                                    ohlcv_field,
+                                    history_start,
+                                    history_end):
+        normalized_field = f"{ohlcv_field}_normalized_by_weight"
 
         candle_independent_instance = candle_independent.CandleIndependence. \
             create_candle_independent_instance(pre_processed_da)
@@ -283,50 +539,157 @@ class ConcreteCryptoOversoldIdentify(AbstractConcreteIdentify):
         return dataset_normalized_coins.sel({"timestamp": dataset_normalized_coins.timestamp[-1]})
 
 
+class ConcreteApproximateOversoldIdentify(AbstractConcreteIdentify):
+    """
+    Oversold scores computed directly on the price matrix from running sums, see
+    `time_weighted_oversold_scores`. A different model from the crypto_oversold pipeline, whose
+    windows sharing a start are scored in one vectorised pass
+    """
+    candle = "1h"
+    coin_drop_fraction = 0.975
+
+    def get_potential_dict_of_all_coins(self,
+                                        history_start,
+                                        history_end,
+                                        potential_coin_strategy):
+        dicts_of_all_coins = self.get_potential_dicts_of_all_coins(history_start,
+                                                                   [history_end],
+                                                                   potential_coin_strategy)
+        if history_end not in dicts_of_all_coins:
+            raise InsufficientHistory
+        return dicts_of_all_coins[history_end]
+
+    def get_potential_dicts_of_all_coins(self,
+                                         history_start,
+                                         history_ends: List,
+                                         potential_coin_strategy) -> Dict:
+        price_matrix = self.full_history_da_dict.get_price_matrix(self.candle,
+                                                                  potential_coin_strategy["ohlcv_field"])
+        scores = self.all_coins_potential_at_history_end(history_start,
+                                                         history_ends,
+                                                         potential_coin_strategy)
+        window_has_history = ~np.isnan(scores).all(axis=1)
+        return {history_end: dict_of_all_coins
+                for history_end, dict_of_all_coins, has_history in zip(history_ends,
+                                                                        scores_to_dicts(price_matrix, scores),
+                                                                        window_has_history)
+                if has_history}
+
+    def get_incremental_scorer(self,
+                               history_start,
+                               potential_coin_strategy) -> IncrementalOversoldScorer:
+        price_matrix = self.full_history_da_dict.get_price_matrix(self.candle,
+                                                                  potential_coin_strategy["ohlcv_field"])
+        return IncrementalOversoldScorer(price_matrix,
+                                         datetime_to_ms(history_start),
+                                         self.coin_drop_fraction)
+
+    def all_coins_potential_at_history_end(self,
+                                           history_start,
+                                           history_ends,
+                                           potential_coin_strategy):
+        price_matrix = self.full_history_da_dict.get_price_matrix(self.candle,
+                                                                  potential_coin_strategy["ohlcv_field"])
+        return time_weighted_oversold_scores(price_matrix,
+                                             datetime_to_ms(history_start),
+                                             [datetime_to_ms(history_end) for history_end in history_ends],
+                                             self.coin_drop_fraction)
+
+
+def get_potential_divergence(full_history_da_dict,
+                             history_start,
+                             history_ends: List,
+                             potential_coin_strategy,
+                             potential_calc_creator: AbstractIdentifyCreator,
+                             reference_creator: Optional[AbstractIdentifyCreator] = None) -> pd.DataFrame:
+    """
+    How far the scores of `potential_calc_creator` are from those of `reference_creator` (default
+    `CryptoOversoldCreator`), one row per history end scored by both: the coins scored by both and by only
+    one of them, the largest and mean absolute score difference and the rank correlation of the scores
+    """
+    if reference_creator is None:
+        reference_creator = CryptoOversoldCreator()
+    dicts_of_all_coins = potential_calc_creator.get_dicts_of_all_coins(full_history_da_dict,
+                                                                       history_start,
+                                                                       history_ends,
+                                                                       potential_coin_strategy)
+    reference_dicts = reference_creator.get_dicts_of_all_coins(full_history_da_dict,
+                                                               history_start,
+                                                               history_ends,
+                                                               potential_coin_strategy)
+    divergence = {}
+    for history_end in history_ends:
+        if history_end not in dicts_of_all_coins or history_end not in reference_dicts:
+            continue
+        scores = pd.Series(dicts_of_all_coins[history_end], dtype=np.float64)
+        reference_scores = pd.Series(reference_dicts[history_end], dtype=np.float64)
+        common = scores.index.intersection(reference_scores.index)
+        difference = (scores[common] - reference_scores[common]).abs()
+        divergence[history_end] = {
+            "common_coins": len(common),
+            "only_compared": len(scores.index.difference(common)),
+            "only_reference": len(reference_scores.index.difference(common)),
+            "max_abs_difference": difference.max(),
+            "mean_abs_difference": difference.mean(),
+            "rank_correlation": scores[common].rank().corr(reference_scores[common].rank()),
+        }
+    return pd.DataFrame.from_dict(divergence, orient="index")
+
+
 class PotentialIdentification:
     def __init__(self,
                  history_access,
                  potential_coin_client,
                  candle,
                  ohlcv_field,
-                 reference_coin,
-                 coins_with_valid_history):
+                 reference_coin):
         self.history_access = history_access
         self.potential_coin_client = potential_coin_client
         self.candle = candle
         self.ohlcv_field = ohlcv_field
         self.reference_coin = reference_coin
-        self.coins_with_valid_history = coins_with_valid_history
-
-    def get_cached_history(self,
-                           history_start: datetime.datetime,
-                           history_end: datetime.datetime,
-                           ) -> List:
-        for start, end in self.coins_with_valid_history.keys():
-            if (start <= history_start) and (end >= history_end):
-                return self.coins_with_valid_history[start, end]
-        raise ValueError
 
     def get_valid_potential_coin_to_buy(self,
                                         simulation_input_dict: Dict,
                                         simulation_start: datetime.datetime,
                                         simulation_at: datetime.datetime) -> List:
-        try:
-            potential_coins = self.potential_coin_client.get_potential_coin_at(
-                consider_history=(simulation_start, simulation_at),
-                potential_coin_strategy={**simulation_input_dict,
-                                         "ohlcv_field": self.ohlcv_field,
-                                         "reference_coin": self.reference_coin}
-            )
-        except MissingPotentialCoinTimeIndexError:
+        potential_coins = self.potential_coin_client.get_potential_coin_as_of(
+            consider_history=(simulation_start, simulation_at),
+            potential_coin_strategy={**simulation_input_dict,
+                                     "ohlcv_field": self.ohlcv_field,
+                                     "reference_coin": self.reference_coin}
+        )
+        if potential_coins is None:
             return []
-        else:
-            filtered_coins = self.filter_coins_with_history(
-                coins=list(potential_coins),
-                history_start=simulation_at,
-                history_end=simulation_at + simulation_input_dict["days_to_run"],
-            )
-            return filtered_coins
+        filtered_coins = self.filter_coins_with_history(
+            coins=list(potential_coins),
+            history_start=simulation_at,
+            history_end=simulation_at + simulation_input_dict["days_to_run"],
+        )
+        return filtered_coins
+
+    def get_next_potential_refresh(self,
+                                   simulation_input_dict: Dict,
+                                   simulation_start: datetime.datetime,
+                                   simulation_at: datetime.datetime) -> Optional[float]:
+        """
+        When no potential coin is found at `simulation_at`, the earliest moment in ms at which one can be:
+        the end of the next stored window of the start, infinite when there is none.
+        None when potential coins are found or computed on demand, as they can change at any candle
+        """
+        if self.potential_coin_client.compute_missing_potential:
+            return None
+        potential_coins = self.potential_coin_client.get_potential_coin_as_of(
+            consider_history=(simulation_start, simulation_at),
+            potential_coin_strategy={**simulation_input_dict,
+                                     "ohlcv_field": self.ohlcv_field,
+                                     "reference_coin": self.reference_coin}
+        )
+        if potential_coins:
+            return None
+        next_end_ms = self.potential_coin_client.get_next_stored_end(simulation_start,
+                                                                     simulation_at)
+        return math.inf if next_end_ms is None else next_end_ms
 
     def filter_coins_with_history(self,
                                   coins: List,
@@ -339,25 +702,9 @@ class PotentialIdentification:
 
     def get_coins_with_sufficient_history(self,
                                           history_start: datetime.datetime,
-                                          history_end: datetime.datetime,
-                                          cache_padding: datetime.timedelta = datetime.timedelta(days=5)):
-        try:
-            return self.get_cached_history(history_start,
-                                           history_end)
-        except ValueError:
-            self.add_valid_coins_with_history(history_start,
-                                              history_end + cache_padding)
-        return self.get_coins_with_sufficient_history(history_start,
-                                                      history_end)
-
-    def add_valid_coins_with_history(self,
-                                     start_time: datetime.datetime,
-                                     end_time: datetime.datetime) -> None:
-        simple_history = get_simple_history(self.history_access,
-                                            start_time,
-                                            end_time,
-                                            self.candle)
-        particular_history = simple_history.sel({"ohlcv_fields": self.ohlcv_field})
-        nan_values = particular_history.isnull().sum(axis=1)
-        sufficient_history_coins = nan_values.where(lambda x: x == 0, drop=True).base_assets.values.tolist()
-        self.coins_with_valid_history[start_time, end_time] = sufficient_history_coins
+                                          history_end: datetime.datetime) -> List:
+        price_matrix = self.history_access.get_price_matrix(self.candle,
+                                                            self.ohlcv_field)
+        full_history_mask = price_matrix.get_full_history_mask(datetime_to_ms(history_start),
+                                                               datetime_to_ms(history_end))
+        return price_matrix.base_assets[full_history_mask].tolist()
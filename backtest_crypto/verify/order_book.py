@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import datetime
+import heapq
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backtest_crypto.utilities.general import Order, OrderFill, OrderSide, OrderType
+
+HeapEntry = Tuple[float, int, int]
+
+
+def get_fill_triggers(order: Order) -> Optional[List[Tuple[float, bool]]]:
+    """
+    Prices, as (threshold, above), at which `order` fills before its timeout: at or above the threshold
+    when `above`, at or below it otherwise. None when the order is tried at any price
+    """
+    if order.order_type == OrderType.Limit:
+        return [(order.limit_price, order.order_side == OrderSide.Sell)]
+    if order.order_type == OrderType.StopLimit and order.order_side == OrderSide.Sell:
+        return [(order.limit_price, True),
+                (order.stop_price, False)]
+    return None
+
+
+class OrderBucket:
+    """Open orders of one (coin, side): a min-heap of the prices to rise to and a max-heap of those to fall to"""
+
+    def __init__(self,
+                 column: Optional[int]):
+        self.column = column
+        self.rising: List[HeapEntry] = []
+        self.falling: List[HeapEntry] = []
+        self.order_count = 0
+
+
+class OrderBook:
+    """
+    Open orders of a simulation, bucketed by coin and side with heaps on their trigger prices and a queue
+    of their timeouts, so that a step only pops the orders whose trigger or timeout has been crossed.
+    Iterating yields the open orders in the order they were added, which is also the order triggered
+    orders are returned in. Heap entries of removed or requeued orders are dropped lazily.
+    `coin_index` maps a coin to its column of the price rows passed to `pop_triggered`
+    """
+
+    def __init__(self,
+                 coin_index: Dict[str, int]):
+        self.coin_index = coin_index
+        self.orders: Dict[int, Order] = {}
+        self.versions: Dict[int, int] = {}
+        self.sequences: Dict[int, int] = {}
+        # Keyed by (coin, is sell), hashing the OrderSide enum is comparatively slow
+        self.buckets: Dict[Tuple[str, bool], OrderBucket] = {}
+        self.timeouts: List[Tuple[datetime.datetime, int, int]] = []
+        self.next_sequence = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self) -> Iterator[Order]:
+        return iter(list(self.orders.values()))
+
+    def __contains__(self, order):
+        return id(order) in self.sequences
+
+    def _push_entries(self,
+                      sequence: int,
+                      order: Order,
+                      bucket: OrderBucket):
+        version = self.versions[sequence]
+        for threshold, above in get_fill_triggers(order) or [(float("-inf"), True)]:
+            if above:
+                heapq.heappush(bucket.rising, (threshold, sequence, version))
+            else:
+                heapq.heappush(bucket.falling, (-threshold, sequence, version))
+        heapq.heappush(self.timeouts, (order.timeout, sequence, version))
+        if len(self.timeouts) > 2 * len(self.orders) + 64:
+            # Re-quoted orders leave stale entries behind, drop them before they outnumber the live ones
+            self.timeouts = [entry for entry in self.timeouts if self._is_current(entry[1], entry[2])]
+            heapq.heapify(self.timeouts)
+
+    def _is_current(self,
+                    sequence: int,
+                    version: int) -> bool:
+        return self.versions.get(sequence) == version
+
+    def _get_bucket(self,
+                    order: Order) -> OrderBucket:
+        bucket_key = (order.base_asset, order.order_side == OrderSide.Sell)
+        try:
+            return self.buckets[bucket_key]
+        except KeyError:
+            bucket = self.buckets[bucket_key] = OrderBucket(self.coin_index.get(order.base_asset))
+            return bucket
+
+    def append(self,
+               order: Order):
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        self.orders[sequence] = order
+        self.versions[sequence] = 0
+        self.sequences[id(order)] = sequence
+        bucket = self._get_bucket(order)
+        bucket.order_count += 1
+        self._push_entries(sequence, order, bucket)
+
+    def remove(self,
+               order: Order):
+        try:
+            sequence = self.sequences.pop(id(order))
+        except KeyError:
+            raise ValueError(f"{order} is not in the order book")
+        del self.orders[sequence]
+        del self.versions[sequence]
+        bucket = self.buckets[order.base_asset, order.order_side == OrderSide.Sell]
+        bucket.order_count -= 1
+        if not bucket.order_count:
+            # Kept for the next order of the coin and side, the trailing re-quote removes and appends in a row
+            bucket.rising.clear()
+            bucket.falling.clear()
+
+    def requeue(self,
+                order: Order):
+        """Pushes fresh heap entries for an order popped as triggered that is still open"""
+        sequence = self.sequences[id(order)]
+        self.versions[sequence] += 1
+        self._push_entries(sequence, order, self._get_bucket(order))
+
+    def _pop_crossed_timeouts(self,
+                              current_time: datetime.datetime,
+                              popped: Dict[int, Order]):
+        while self.timeouts and self.timeouts[0][0] < current_time:
+            _, sequence, version = heapq.heappop(self.timeouts)
+            if self._is_current(sequence, version):
+                popped[sequence] = self.orders[sequence]
+
+    def _pop_crossed_prices(self,
+                            heap: List[HeapEntry],
+                            limit: float,
+                            popped: Dict[int, Order]):
+        while heap and heap[0][0] <= limit:
+            _, sequence, version = heapq.heappop(heap)
+            if self._is_current(sequence, version):
+                popped[sequence] = self.orders[sequence]
+
+    def pop_triggered(self,
+                      price_row: np.ndarray,
+                      current_time: datetime.datetime) -> List[Order]:
+        """
+        Orders past their timeout, or whose trigger is crossed by their coin's price in `price_row`.
+        They stay in the book; the ones not filled have to be requeued
+        """
+        popped = {}
+        self._pop_crossed_timeouts(current_time, popped)
+        for bucket in self.buckets.values():
+            if bucket.column is None or not bucket.order_count:
+                continue
+            # A missing price is NaN, which crosses nothing. Checking the heap tops first keeps
+            # the buckets without a crossing to two comparisons
+            price = price_row[bucket.column]
+            if bucket.rising and bucket.rising[0][0] <= price:
+                self._pop_crossed_prices(bucket.rising, price, popped)
+            if bucket.falling and bucket.falling[0][0] <= -price:
+                self._pop_crossed_prices(bucket.falling, -price, popped)
+        return [popped[sequence] for sequence in sorted(popped)]
+
+    def iter_triggered(self,
+                       price_row: np.ndarray,
+                       current_time: datetime.datetime) -> Iterator[Order]:
+        """pop_triggered, then removing the orders filled meanwhile and requeueing the others"""
+        triggered = self.pop_triggered(price_row, current_time)
+        yield from triggered
+        for order in triggered:
+            if order not in self:
+                continue
+            if order.complete == OrderFill.Filled:
+                self.remove(order)
+            else:
+                self.requeue(order)
+
+    def pop_timed_out(self,
+                      current_time: datetime.datetime) -> List[Order]:
+        """Removes and returns the orders past their timeout"""
+        popped = {}
+        self._pop_crossed_timeouts(current_time, popped)
+        timed_out = [popped[sequence] for sequence in sorted(popped)]
+        for order in timed_out:
+            self.remove(order)
+        return timed_out
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+import numpy as np
+
+from backtest_crypto.history_collect.price_matrix import PriceMatrix
+
+
+def normalize_against_tickers(ratios: np.ndarray) -> np.ndarray:
+    """Divides each window's ratios by their mean over the coins that have one"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        present = ~np.isnan(ratios)
+        present_count = present.sum(axis=-1, keepdims=True)
+        ticker_mean = np.where(present, ratios, 0).sum(axis=-1, keepdims=True) / present_count
+        return ratios / ticker_mean
+
+
+def time_weighted_oversold_scores(price_matrix: PriceMatrix,
+                                  start_ms: int,
+                                  end_ms_list,
+                                  coin_drop_fraction: float = 0.975) -> np.ndarray:
+    """
+    Oversold scores of all coins for windows sharing `start_ms`, one row per end in `end_ms_list`.
+    The score is the last price in the window over the mean price of the window, divided by the
+    mean of that ratio across coins. Coins with fewer than `coin_drop_fraction` of the window's
+    candles are NaN, as are all coins of an empty window or an empty price matrix.
+    An approximation of the crypto_oversold pipeline, see `get_potential_divergence` for how far it is off.
+    Every window is answered from the running sums of the price matrix, so the cost does not
+    depend on the window length
+    """
+    end_ms_array = np.asarray(end_ms_list, dtype=np.int64)
+    if not len(price_matrix.timestamps):
+        return np.full((len(end_ms_array), len(price_matrix.base_assets)), np.nan)
+    lower = int(np.searchsorted(price_matrix.timestamps, start_ms, side="right"))
+    upper = np.maximum(lower, np.searchsorted(price_matrix.timestamps, end_ms_array, side="left"))
+
+    valid_count = price_matrix.cumulative_valid_count[upper] - price_matrix.cumulative_valid_count[lower]
+    price_sum = price_matrix.cumulative_values[upper] - price_matrix.cumulative_values[lower]
+    last_price = price_matrix.values[np.maximum(upper - 1, 0)]
+    ratios = get_oversold_ratios(last_price,
+                                 price_sum,
+                                 valid_count,
+                                 (upper - lower)[:, np.newaxis],
+                                 coin_drop_fraction)
+    return normalize_against_tickers(ratios)
+
+
+def get_oversold_ratios(last_price: np.ndarray,
+                        price_sum: np.ndarray,
+                        valid_count: np.ndarray,
+                        window_length,
+                        coin_drop_fraction: float) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = last_price * valid_count / price_sum
+    enough_history = (window_length > 0) & (valid_count >= coin_drop_fraction * window_length)
+    return np.where(enough_history & np.isfinite(ratios), ratios, np.nan)
+
+
+class IncrementalOversoldScorer:
+    """
+    Running price sums and valid counts for windows with a fixed start. Growing the window by one
+    candle costs O(coins), so consecutive ends of a simulation are scored without recomputing
+    the window. Gives the same scores as `time_weighted_oversold_scores`
+    """
+
+    def __init__(self,
+                 price_matrix: PriceMatrix,
+                 start_ms: int,
+                 coin_drop_fraction: float = 0.975):
+        self.price_matrix = price_matrix
+        self.coin_drop_fraction = coin_drop_fraction
+        self.lower = int(np.searchsorted(price_matrix.timestamps, start_ms, side="right"))
+        self.reset()
+
+    def reset(self):
+        self.upper = self.lower
+        self.price_sum = np.zeros(len(self.price_matrix.base_assets), dtype=np.float64)
+        self.valid_count = np.zeros(len(self.price_matrix.base_assets), dtype=np.int64)
+
+    @property
+    def window_length(self) -> int:
+        return self.upper - self.lower
+
+    def add_row(self,
+                row_number: int):
+        row = self.price_matrix.values[row_number]
+        valid = ~np.isnan(row)
+        self.price_sum += np.where(valid, row, 0.0)
+        self.valid_count += valid
+        self.upper = row_number + 1
+
+    def advance_to(self,
+                   end_ms: int):
+        target = max(self.lower, int(np.searchsorted(self.price_matrix.timestamps, end_ms, side="left")))
+        if target < self.upper:
+            self.reset()
+        for row_number in range(self.upper, target):
+            self.add_row(row_number)
+
+    def get_scores(self) -> np.ndarray:
+        if not len(self.price_matrix.timestamps):
+            return np.full(len(self.price_matrix.base_assets), np.nan)
+        last_price = self.price_matrix.values[max(self.upper - 1, 0)]
+        ratios = get_oversold_ratios(last_price,
+                                     self.price_sum,
+                                     self.valid_count,
+                                     self.window_length,
+                                     self.coin_drop_fraction)
+        return normalize_against_tickers(ratios)
+
+    def get_score_dict(self) -> Dict[str, float]:
+        return scores_to_dicts(self.price_matrix, self.get_scores()[np.newaxis])[0]
+
+
+def scores_to_dicts(price_matrix: PriceMatrix,
+                    scores: np.ndarray) -> List[Dict[str, float]]:
+    dict_list = []
+    for score_row in scores:
+        present = np.flatnonzero(~np.isnan(score_row))
+        dict_list.append(dict(zip(price_matrix.base_assets[present].tolist(),
+                                  score_row[present].tolist())))
+    return dict_list
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pathlib
+import pickle
+import queue
+import threading
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from backtest_crypto.verify.potential_sqlite import SQLitePotentialStore
+from backtest_crypto.verify.potential_store import PotentialScoreStore
+
+logger = logging.getLogger(__name__)
+
+TimeInterval = Tuple[int, int]
+
+
+def atomic_write_bytes(path: pathlib.Path,
+                       contents: bytes):
+    temporary_path = path.with_name(f".{path.name}.tmp")
+    with open(temporary_path, "wb") as fp:
+        fp.write(contents)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temporary_path, path)
+
+
+class PotentialShardWriter:
+    """
+    Append-only store of the all-coin potential scores, one shard per (start_ms, end_ms) interval.
+    A manifest lists the finished intervals so an interrupted run resumes where it stopped;
+    intervals without sufficient history are recorded without a shard. Every shard appends one line
+    to the manifest log, which is folded into the manifest on `close` and `compact`.
+    The manifest also records the `identity` (creator, field) the scores were computed with. Shards of a
+    different identity are discarded when the writer is opened with one, readers pass None to take any.
+    Shards are written on a background thread, `compact` merges them into one pickle
+    """
+    manifest_name = "manifest.json"
+    manifest_log_name = "manifest.log"
+
+    def __init__(self,
+                 shard_dir,
+                 identity: Optional[Dict[str, str]] = None,
+                 max_pending: int = 64):
+        self.shard_dir = pathlib.Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self._manifest_log = None
+        stored_identity, self.manifest = self.read_manifest()
+        if identity is not None and self.manifest and stored_identity != identity:
+            logger.warning(f"Potential shards in {self.shard_dir} were computed for {stored_identity}, "
+                           f"not {identity}. Discarding them")
+            self.discard_shards()
+        self.identity = identity if identity is not None else stored_identity
+        if identity is not None and (stored_identity != identity or self.manifest_log_path.exists()):
+            # The identity is recorded before the first shard and a log left by an interrupted run,
+            # possibly ending in a partial line, is folded in before appending to it
+            self.consolidate_manifest()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        return self.shard_dir / self.manifest_name
+
+    @property
+    def manifest_log_path(self) -> pathlib.Path:
+        return self.shard_dir / self.manifest_log_name
+
+    @staticmethod
+    def get_interval_key(time_interval: TimeInterval) -> str:
+        return "%d_%d" % tuple(time_interval)
+
+    def read_manifest(self) -> Tuple[Optional[Dict[str, str]], Dict[str, Optional[str]]]:
+        """The manifest with the intervals of the manifest log added"""
+        try:
+            with open(self.manifest_path, "r") as fp:
+                manifest = json.load(fp)
+            identity, intervals = manifest.get("identity"), manifest["intervals"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            identity, intervals = None, {}
+        try:
+            with open(self.manifest_log_path, "r") as fp:
+                for line in fp:
+                    try:
+                        interval_key, shard_name = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash, its shard is written again
+                        continue
+                    intervals[interval_key] = shard_name
+        except FileNotFoundError:
+            pass
+        return identity, intervals
+
+    def append_to_manifest_log(self,
+                               interval_key: str,
+                               shard_name: Optional[str]):
+        if self._manifest_log is None:
+            self._manifest_log = open(self.manifest_log_path, "a")
+        self._manifest_log.write(json.dumps([interval_key, shard_name]) + "\n")
+        self._manifest_log.flush()
+        os.fsync(self._manifest_log.fileno())
+
+    def consolidate_manifest(self):
+        """Writes all intervals into the manifest and empties the manifest log"""
+        if self._manifest_log is not None:
+            self._manifest_log.close()
+            self._manifest_log = None
+        atomic_write_bytes(self.manifest_path,
+                           json.dumps({"identity": self.identity,
+                                       "intervals": self.manifest}).encode())
+        self.manifest_log_path.unlink(missing_ok=True)
+
+    def discard_shards(self):
+        for shard_name in self.manifest.values():
+            if shard_name is not None:
+                (self.shard_dir / shard_name).unlink(missing_ok=True)
+        self.manifest = {}
+        self.manifest_path.unlink(missing_ok=True)
+        self.manifest_log_path.unlink(missing_ok=True)
+
+    @property
+    def completed_intervals(self) -> Set[TimeInterval]:
+        return {tuple(map(int, key.split("_"))) for key in self.manifest.keys()}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop,
+                                            name="potential-shard-writer",
+                                            daemon=True)
+            self._thread.start()
+
+    def submit(self,
+               time_interval: TimeInterval,
+               dict_of_all_coins: Optional[Dict[str, float]]):
+        if self._error is not None:
+            raise self._error
+        self.start()
+        self._queue.put((tuple(time_interval), dict_of_all_coins))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self.write_shard(*item)
+            except BaseException as e:
+                self._error = e
+
+    def write_shard(self,
+                    time_interval: TimeInterval,
+                    dict_of_all_coins: Optional[Dict[str, float]]):
+        interval_key = self.get_interval_key(time_interval)
+        shard_name = None
+        if dict_of_all_coins is not None:
+            shard_name = f"{interval_key}.pickle"
+            atomic_write_bytes(self.shard_dir / shard_name,
+                               pickle.dumps(dict_of_all_coins, protocol=pickle.HIGHEST_PROTOCOL))
+        self.manifest[interval_key] = shard_name
+        self.append_to_manifest_log(interval_key,
+                                    shard_name)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._manifest_log is not None:
+            self.consolidate_manifest()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> PotentialShardWriter:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def iter_windows(self) -> Iterator[Tuple[int, int, Dict[str, float]]]:
+        """Reads the shards one at a time, ordered by (start_ms, end_ms)"""
+        for time_interval in sorted(self.completed_intervals):
+            shard_name = self.manifest[self.get_interval_key(time_interval)]
+            if shard_name is None:
+                continue
+            with open(self.shard_dir / shard_name, "rb") as fp:
+                yield (*time_interval, pickle.load(fp))
+
+    def load_store(self) -> PotentialScoreStore:
+        store = PotentialScoreStore(initial_capacity=max(len(self.manifest), 1))
+        for start_ms, end_ms, dict_of_all_coins in self.iter_windows():
+            store.add_pair(start_ms, end_ms, dict_of_all_coins)
+        return store
+
+    def compact(self,
+                pickled_file_path):
+        """
+        Writes all shards into one file: a SQLite potential store for database paths,
+        otherwise a pickle in the layout read by `PotentialScoreStore.load_pickled`
+        """
+        if self._manifest_log is not None or self.manifest_log_path.exists():
+            self.consolidate_manifest()
+        potential_store = self.load_store()
+        if SQLitePotentialStore.is_database_path(pickled_file_path):
+            SQLitePotentialStore(pickled_file_path).write_score_store(potential_store)
+        else:
+            potential_store.to_series().to_pickle(pickled_file_path)
+        logger.info(f"Compacted {len(self.manifest)} potential shards into {pickled_file_path}")
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import pathlib
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from sqlalchemy import create_engine, text
+
+from backtest_crypto.utilities.general import datetime_to_ms
+from backtest_crypto.verify.potential_store import PotentialScoreStore
+
+logger = logging.getLogger(__name__)
+
+PotentialWindow = Tuple[int, int, Dict[str, float]]
+
+
+class SQLitePotentialStore:
+    """
+    Potential scores persisted in SQLite as indexed (start_ms, end_ms, coin) rows, so a run
+    only reads the windows it asks for. Windows are recorded separately so that a window
+    without any scored coin is still known to have been calculated.
+    A `read_only` store neither creates the file nor its tables
+    """
+    database_suffixes = (".db", ".sqlite", ".sqlite3")
+    windows_table = "POTENTIAL_WINDOWS"
+    scores_table = "POTENTIAL_SCORES"
+
+    def __init__(self,
+                 file_path,
+                 read_only: bool = False):
+        self.file_path = pathlib.Path(file_path)
+        self.read_only = read_only
+        self._engine = None
+        if not read_only:
+            self.create_tables()
+
+    @classmethod
+    def is_database_path(cls,
+                         file_path) -> bool:
+        return pathlib.Path(file_path).suffix in cls.database_suffixes
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            if self.read_only:
+                self._engine = create_engine(f"sqlite:///file:{self.file_path.resolve()}?mode=ro&uri=true")
+            else:
+                self._engine = create_engine(f"sqlite:///{self.file_path}")
+        return self._engine
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_engine"] = None
+        return state
+
+    def create_tables(self):
+        with self.engine.begin() as connection:
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {self.windows_table} "
+                                    f"(start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL, "
+                                    f"PRIMARY KEY (start_ms, end_ms))"))
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{self.windows_table}_end_ms "
+                                    f"ON {self.windows_table} (end_ms)"))
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {self.scores_table} "
+                                    f"(start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL, "
+                                    f"coin TEXT NOT NULL, score REAL NOT NULL, "
+                                    f"PRIMARY KEY (start_ms, end_ms, coin))"))
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{self.scores_table}_end_ms "
+                                    f"ON {self.scores_table} (end_ms)"))
+
+    def add_windows(self,
+                    potential_windows: Iterable[PotentialWindow]):
+        window_rows = []
+        score_rows = []
+        for start_ms, end_ms, dict_of_all_coins in potential_windows:
+            window_rows.append({"start_ms": int(start_ms), "end_ms": int(end_ms)})
+            score_rows.extend({"start_ms": int(start_ms), "end_ms": int(end_ms), "coin": coin, "score": score}
+                              for coin, score in dict_of_all_coins.items())
+        if not window_rows:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(text(f"DELETE FROM {self.scores_table} "
+                                    f"WHERE start_ms = :start_ms AND end_ms = :end_ms"),
+                               window_rows)
+            connection.execute(text(f"INSERT OR REPLACE INTO {self.windows_table} (start_ms, end_ms) "
+                                    f"VALUES (:start_ms, :end_ms)"),
+                               window_rows)
+            if score_rows:
+                connection.execute(text(f"INSERT INTO {self.scores_table} (start_ms, end_ms, coin, score) "
+                                        f"VALUES (:start_ms, :end_ms, :coin, :score)"),
+                                   score_rows)
+        logger.debug(f"Stored {len(window_rows)} potential windows with {len(score_rows)} scores")
+
+    def write_score_store(self,
+                          potential_store: PotentialScoreStore):
+        self.add_windows(potential_store.iter_pairs())
+
+    def read_windows(self,
+                     where_clause: str,
+                     params: Dict) -> PotentialScoreStore:
+        with self.engine.connect() as connection:
+            windows = connection.execute(text(f"SELECT start_ms, end_ms FROM {self.windows_table} "
+                                              f"WHERE {where_clause} ORDER BY start_ms, end_ms"),
+                                         params).fetchall()
+            scores = connection.execute(text(f"SELECT start_ms, end_ms, coin, score FROM {self.scores_table} "
+                                             f"WHERE {where_clause}"),
+                                        params).fetchall()
+        dicts_of_all_coins = {(start_ms, end_ms): {} for start_ms, end_ms in windows}
+        for start_ms, end_ms, coin, score in scores:
+            dicts_of_all_coins[start_ms, end_ms][coin] = score
+        potential_store = PotentialScoreStore(initial_capacity=max(len(windows), 1))
+        for (start_ms, end_ms), dict_of_all_coins in dicts_of_all_coins.items():
+            potential_store.add_pair(start_ms, end_ms, dict_of_all_coins)
+        return potential_store
+
+    def iter_windows(self) -> Iterator[PotentialWindow]:
+        """Streams all windows ordered by (start_ms, end_ms)"""
+        with self.engine.connect() as connection:
+            rows = connection.execute(text(f"SELECT w.start_ms, w.end_ms, s.coin, s.score "
+                                           f"FROM {self.windows_table} AS w LEFT JOIN {self.scores_table} AS s "
+                                           f"ON w.start_ms = s.start_ms AND w.end_ms = s.end_ms "
+                                           f"ORDER BY w.start_ms, w.end_ms"))
+            for (start_ms, end_ms), window_rows in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+                yield start_ms, end_ms, {coin: score for _, _, coin, score in window_rows if coin is not None}
+
+    def get_window_ends(self,
+                        start_ms: int) -> List[int]:
+        """Ends of the stored windows beginning at `start_ms`, without reading their scores"""
+        with self.engine.connect() as connection:
+            rows = connection.execute(text(f"SELECT end_ms FROM {self.windows_table} "
+                                           f"WHERE start_ms = :start_ms ORDER BY end_ms"),
+                                      {"start_ms": int(start_ms)}).fetchall()
+        return [end_ms for end_ms, in rows]
+
+    def load_start(self,
+                   history_start) -> PotentialScoreStore:
+        """All windows beginning at `history_start`"""
+        return self.read_windows("start_ms = :start_ms",
+                                 {"start_ms": datetime_to_ms(history_start)})
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backtest_crypto.utilities.general import datetime_to_ms, ms_to_datetime
+
+
+def to_ms(moment) -> int:
+    if isinstance(moment, pd.Timestamp):
+        moment = moment.to_pydatetime()
+    if isinstance(moment, datetime.datetime):
+        return datetime_to_ms(moment)
+    return int(moment)
+
+
+class PotentialScoreStore:
+    """
+    Potential scores of all coins for the (start, end) history pairs that were actually calculated.
+    One float64 row per pair over a shared coin axis, coins without a score are NaN
+    """
+
+    def __init__(self,
+                 initial_capacity: int = 64):
+        self.base_assets = []
+        self.coin_index: Dict[str, int] = {}
+        self.pair_index: Dict[Tuple[int, int], int] = {}
+        self.scores = np.full((initial_capacity, 0), np.nan, dtype=np.float64)
+        self._sorted_rows: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._ends_per_start: Dict[int, List[int]] = {}
+
+    def __len__(self):
+        return len(self.pair_index)
+
+    def __contains__(self, pair):
+        return self.get_pair_key(*pair) in self.pair_index
+
+    @staticmethod
+    def get_pair_key(history_start,
+                     history_end) -> Tuple[int, int]:
+        return to_ms(history_start), to_ms(history_end)
+
+    def ensure_capacity(self,
+                        row_count: int,
+                        coin_count: int):
+        rows, coins = self.scores.shape
+        if row_count <= rows and coin_count <= coins:
+            return
+        grown = np.full((max(rows, 1) * 2 if row_count > rows else rows,
+                         max(coins * 2, coin_count) if coin_count > coins else coins),
+                        np.nan,
+                        dtype=np.float64)
+        grown[:rows, :coins] = self.scores
+        self.scores = grown
+
+    def get_coin_positions(self,
+                           coins) -> np.ndarray:
+        for coin in coins:
+            if coin not in self.coin_index:
+                self.coin_index[coin] = len(self.base_assets)
+                self.base_assets.append(coin)
+        return np.fromiter((self.coin_index[coin] for coin in coins), dtype=np.intp, count=len(coins))
+
+    def add_pair(self,
+                 history_start,
+                 history_end,
+                 score_dict: Dict[str, float]):
+        key = self.get_pair_key(history_start, history_end)
+        positions = self.get_coin_positions(list(score_dict.keys()))
+        row = self.pair_index.get(key, len(self.pair_index))
+        self.ensure_capacity(row + 1, len(self.base_assets))
+        self.scores[row] = np.nan
+        self.scores[row, positions] = np.fromiter(score_dict.values(), dtype=np.float64, count=len(positions))
+        if key not in self.pair_index:
+            bisect.insort(self._ends_per_start.setdefault(key[0], []), key[1])
+        self.pair_index[key] = row
+        self._sorted_rows.pop(row, None)
+
+    def get_as_of_key(self,
+                      history_start,
+                      history_end,
+                      max_staleness_ms: int = 0) -> Optional[Tuple[int, int]]:
+        """Pair with the latest stored end <= `history_end` for the same start, at most `max_staleness_ms` older"""
+        start_ms, end_ms = self.get_pair_key(history_start, history_end)
+        ends = self._ends_per_start.get(start_ms)
+        if not ends:
+            return None
+        position = bisect.bisect_right(ends, end_ms) - 1
+        if position < 0 or end_ms - ends[position] > max_staleness_ms:
+            return None
+        return start_ms, ends[position]
+
+    def get_next_end(self,
+                     history_start,
+                     history_end) -> Optional[int]:
+        """First stored end after `history_end` for the same start"""
+        start_ms, end_ms = self.get_pair_key(history_start, history_end)
+        ends = self._ends_per_start.get(start_ms, [])
+        position = bisect.bisect_right(ends, end_ms)
+        return ends[position] if position < len(ends) else None
+
+    def get_row(self,
+                history_start,
+                history_end) -> np.ndarray:
+        return self.scores[self.pair_index[self.get_pair_key(history_start, history_end)], :len(self.base_assets)]
+
+    def get_scores(self,
+                   history_start,
+                   history_end) -> Dict[str, float]:
+        row = self.get_row(history_start, history_end)
+        present = np.flatnonzero(~np.isnan(row))
+        return dict(zip(np.asarray(self.base_assets)[present].tolist(), row[present].tolist()))
+
+    def get_sorted_row(self,
+                       history_start,
+                       history_end) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores of the present coins in ascending order and their positions on the coin axis"""
+        row_number = self.pair_index[self.get_pair_key(history_start, history_end)]
+        if row_number not in self._sorted_rows:
+            row = self.scores[row_number, :len(self.base_assets)]
+            present = np.flatnonzero(~np.isnan(row))
+            order = present[np.argsort(row[present], kind="stable")]
+            self._sorted_rows[row_number] = (row[order], order)
+        return self._sorted_rows[row_number]
+
+    def get_band_bounds(self,
+                        history_start,
+                        history_end,
+                        lower_cutoffs,
+                        higher_cutoffs) -> Tuple[np.ndarray, np.ndarray]:
+        """Slice bounds into the sorted row of the scores strictly between each lower and higher cutoff"""
+        sorted_scores, _ = self.get_sorted_row(history_start, history_end)
+        lower = np.searchsorted(sorted_scores, lower_cutoffs, side="right")
+        upper = np.searchsorted(sorted_scores, higher_cutoffs, side="left")
+        return lower, np.maximum(lower, upper)
+
+    def filter_potential(self,
+                         history_start,
+                         history_end,
+                         lower_cutoff: float,
+                         higher_cutoff: float) -> Dict[str, float]:
+        return self.filter_potential_batch(history_start,
+                                           history_end,
+                                           [lower_cutoff],
+                                           [higher_cutoff])[0]
+
+    def filter_potential_batch(self,
+                               history_start,
+                               history_end,
+                               lower_cutoffs,
+                               higher_cutoffs) -> List[Dict[str, float]]:
+        sorted_scores, positions = self.get_sorted_row(history_start, history_end)
+        lower, upper = self.get_band_bounds(history_start,
+                                            history_end,
+                                            np.asarray(lower_cutoffs, dtype=np.float64),
+                                            np.asarray(higher_cutoffs, dtype=np.float64))
+        sorted_coins = np.asarray(self.base_assets)[positions].tolist()
+        sorted_scores = sorted_scores.tolist()
+        return [dict(zip(sorted_coins[start:end], sorted_scores[start:end]))
+                for start, end in zip(lower.tolist(), upper.tolist())]
+
+    def iter_pairs(self) -> Iterator[Tuple[int, int, Dict[str, float]]]:
+        for start_ms, end_ms in sorted(self.pair_index):
+            yield start_ms, end_ms, self.get_scores(start_ms, end_ms)
+
+    def update(self,
+               other: PotentialScoreStore):
+        for start_ms, end_ms, dict_of_all_coins in other.iter_pairs():
+            self.add_pair(start_ms, end_ms, dict_of_all_coins)
+
+    @classmethod
+    def from_pickled_series(cls,
+                            pickled_series: pd.Series) -> PotentialScoreStore:
+        """Converts the legacy (start, end) indexed Series of single-element lists of dicts"""
+        store = cls(initial_capacity=max(len(pickled_series), 1))
+        for (history_start, history_end), value in pickled_series.items():
+            if isinstance(value, list):
+                store.add_pair(history_start, history_end, value[0])
+        return store
+
+    @classmethod
+    def load_pickled(cls,
+                     pickled_potential_coin_path) -> PotentialScoreStore:
+        pickled = pd.read_pickle(pickled_potential_coin_path)
+        if isinstance(pickled, cls):
+            return pickled
+        return cls.from_pickled_series(pickled)
+
+    def to_series(self) -> pd.Series:
+        """Legacy layout, kept for the existing pickles and tooling"""
+        keys = sorted(self.pair_index)
+        index = pd.MultiIndex.from_arrays([[ms_to_datetime(start) for start, _ in keys],
+                                           [ms_to_datetime(end) for _, end in keys]],
+                                          names=["start_time", "end_time"])
+        return pd.Series([[self.get_scores(*key)] for key in keys],
+                         index=index,
+                         name="all",
+                         dtype=object)
@@ -1,22 +1,32 @@
 import datetime
-import functools
 import logging
 import math
 import random
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from backtest_crypto.history_collect.gather_history import get_instantaneous_history_from_datarray
+import numpy as np
+
+from backtest_crypto.history_collect.gather_history import get_instantaneous_history_from_datarray, \
+    get_instantaneous_prices_from_datarray
 from backtest_crypto.utilities.general import InsufficientHistory, \
-    InsufficientBalance, Order, HoldingCoin, OrderType, OrderSide, OrderFill, OrderScheme
+    InsufficientBalance, Order, HoldingCoin, OrderType, OrderSide, OrderFill, OrderScheme, datetime_to_ms
 from backtest_crypto.utilities.iterators import TimeIntervalIterator
+from backtest_crypto.verify.fill_search import SimulationPriceWindow
+from backtest_crypto.verify.holdings_ledger import HoldingsLedger
 from backtest_crypto.verify.identify_potential_coins import PotentialIdentification
+from backtest_crypto.verify.order_book import OrderBook, get_fill_triggers
 
 logger = logging.getLogger(__name__)
-Holdings = List[HoldingCoin]
+Holdings = HoldingsLedger
+# Simulation inputs that only change how the held coins are sold
+SELL_PARAMETERS = ("percentage_increase", "stop_price_sell", "limit_sell_adjust_trail")
 
 
 class AbstractTimeStepSimulateCreator(ABC):
+    # Event-driven simulators only visit the candles at which the holdings can change
+    event_driven = False
+
     def factory_method(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -31,12 +41,33 @@ class AbstractTimeStepSimulateCreator(ABC):
         concrete = self.factory_method(
             full_history_da_dict,
             ohlcv_field,
-            potential_coin_client)
+            potential_coin_client,
+            event_driven=self.event_driven)
         for simulate_criterion in simulate_criteria:
             method = getattr(concrete, simulate_criterion)
             criteria[simulate_criterion] = method(simulation_input_dict)
         return criteria
 
+    def simulate_timestep_lanes(self,
+                                ohlcv_field,
+                                simulation_input_dicts,
+                                potential_coin_client,
+                                simulate_criteria,
+                                full_history_da_dict
+                                ):
+        """simulate_timesteps for input dicts differing only in SELL_PARAMETERS, None for the lanes without history"""
+        lane_criteria = [{} for _ in simulation_input_dicts]
+        concrete = self.factory_method(
+            full_history_da_dict,
+            ohlcv_field,
+            potential_coin_client,
+            event_driven=self.event_driven)
+        for simulate_criterion in simulate_criteria:
+            method = getattr(concrete, f"{simulate_criterion}_for_lanes")
+            for criteria, value in zip(lane_criteria, method(simulation_input_dicts)):
+                criteria[simulate_criterion] = value
+        return [None if None in criteria.values() else criteria for criteria in lane_criteria]
+
 
 class MarketBuyLimitSellSimulationCreator(AbstractTimeStepSimulateCreator):
     def factory_method(self, *args, **kwargs):
@@ -53,6 +84,24 @@ class LimitBuyLimitSellSimulationCreator(AbstractTimeStepSimulateCreator):
         return LimitBuyLimitSellSimulatorConcrete(*args, **kwargs)
 
 
+class SimulationLane:
+    """Holdings, orders, standard prices and random generator of one set of sell parameters"""
+
+    def __init__(self,
+                 simulation_input_dict,
+                 holdings: Holdings,
+                 live_orders: OrderBook,
+                 random_state):
+        self.simulation_input_dict = simulation_input_dict
+        self.holdings = holdings
+        self.live_orders = live_orders
+        self.standard_prices = {}
+        self.random_generator = random.Random()
+        self.random_generator.setstate(random_state)
+        self.next_step = 0
+        self.insufficient_history = False
+
+
 class AbstractTimestepSimulatorConcrete(ABC):
     _shared_state = {}
 
@@ -60,22 +109,25 @@ class AbstractTimestepSimulatorConcrete(ABC):
                  full_dataarray_da_dict,
                  ohlcv_field,
                  potential_coin_client,
+                 event_driven=False,
                  ):
         self.__dict__ = self._shared_state
         if not self._shared_state:
             self.overall_history_dict = {}
             self.maximum_history_dict = {}
-            self.coins_with_valid_history = {}
             self.dust = {}
             self.standard_prices = {}
         self.ohlcv_field = ohlcv_field
         self.full_dataarray_da_dict = full_dataarray_da_dict
         self.potential_coin_client = potential_coin_client
+        self.event_driven = event_driven
         self.reference_coin = "BTC"
         self.candle = "1h"
         self.tolerance = 0.001
         self.trade_executed = 0
-        self.live_orders = []
+        self.live_orders = self.create_order_book()
+        self.random_generator = random
+        self.candle_cache = None
         self.banned_coins = {}
         self.order_operations = OrderOperations()
         self.holding_operations = HoldingOperations(self.reference_coin,
@@ -88,35 +140,244 @@ class AbstractTimestepSimulatorConcrete(ABC):
                                                                 self.potential_coin_client,
                                                                 self.candle,
                                                                 self.ohlcv_field,
-                                                                self.reference_coin,
-                                                                self.coins_with_valid_history)
+                                                                self.reference_coin)
 
     @abstractmethod
     def manage_simulation_per_timestep(self, *args, **kwargs):
         pass
 
     def calculate_end_of_run_value(self, simulation_input_dict):
-        simulation_start, simulation_end = TimeIntervalIterator.get_datetime_objects_from_str(
+        simulation_start, simulation_end = TimeIntervalIterator.get_datetime_objects_from_interval(
             simulation_input_dict["time_intervals"]
         )
-        holdings = [HoldingCoin(
-            coin_name=self.reference_coin,
-            quantity=1,
-            order_instance=None
-        )]
-        self.live_orders = []
-        for simulation_at in TimeIntervalIterator.time_iterator(simulation_start,
-                                                                simulation_end,
-                                                                interval=TimeIntervalIterator.string_to_datetime(
-                                                                    self.candle)):
+        holdings = self.holding_operations.get_initial_holdings()
+        self.live_orders = self.create_order_book()
+        step_times = list(TimeIntervalIterator.time_iterator(simulation_start,
+                                                             simulation_end,
+                                                             interval=TimeIntervalIterator.string_to_datetime(
+                                                                 self.candle)))
+        price_window = SimulationPriceWindow(self.full_dataarray_da_dict.get_price_matrix(self.candle),
+                                             step_times) if self.event_driven else None
+        step = 0
+        while step < len(step_times):
             holdings = self.manage_simulation_per_timestep(holdings,
                                                            simulation_start,
-                                                           simulation_at,
+                                                           step_times[step],
                                                            simulation_input_dict)
-        self.live_orders = []
+            if price_window is None:
+                step += 1
+            else:
+                step = self.get_next_event_step(holdings,
+                                                step,
+                                                price_window,
+                                                simulation_start,
+                                                simulation_input_dict)
+        self.live_orders = self.create_order_book()
         return self.holding_operations.get_total_holding_worth(holdings,
                                                                simulation_end)
 
+    def calculate_end_of_run_value_for_lanes(self, simulation_input_dicts):
+        """
+        calculate_end_of_run_value of input dicts that differ only in SELL_PARAMETERS, walking the window once.
+        The lanes are stepped one after the other at every candle, each with its own holdings, orders and
+        random generator swapped in, and share the prices and potential coins of the candle. All lanes start
+        from the same random state, so they buy the same coins until their sells differ. The global random
+        state is left where the first lane's ended
+        """
+        shared_inputs = [{key: value for key, value in simulation_input_dict.items() if key not in SELL_PARAMETERS}
+                         for simulation_input_dict in simulation_input_dicts]
+        if any(shared_input != shared_inputs[0] for shared_input in shared_inputs):
+            raise ValueError(f"Simulation lanes may only differ in {SELL_PARAMETERS}")
+        simulation_start, simulation_end = TimeIntervalIterator.get_datetime_objects_from_interval(
+            simulation_input_dicts[0]["time_intervals"]
+        )
+        step_times = list(TimeIntervalIterator.time_iterator(simulation_start,
+                                                             simulation_end,
+                                                             interval=TimeIntervalIterator.string_to_datetime(
+                                                                 self.candle)))
+        price_window = SimulationPriceWindow(self.full_dataarray_da_dict.get_price_matrix(self.candle),
+                                             step_times) if self.event_driven else None
+        random_state = random.getstate()
+        lanes = [SimulationLane(simulation_input_dict,
+                                self.holding_operations.get_initial_holdings(),
+                                self.create_order_book(),
+                                random_state) for simulation_input_dict in simulation_input_dicts]
+        self.candle_cache = {}
+        try:
+            step = 0
+            while step < len(step_times):
+                self.candle_cache.clear()
+                for lane in lanes:
+                    if lane.next_step == step:
+                        self.step_lane(lane,
+                                       step,
+                                       step_times,
+                                       simulation_start,
+                                       price_window)
+                step = min(lane.next_step for lane in lanes)
+        finally:
+            self.candle_cache = None
+            self.random_generator = random
+            self.live_orders = self.create_order_book()
+            # Move the global generator on as a single run would, so the next group does not replay these draws
+            random.setstate(lanes[0].random_generator.getstate())
+        return [None if lane.insufficient_history else
+                self.holding_operations.get_total_holding_worth(lane.holdings,
+                                                                simulation_end)
+                for lane in lanes]
+
+    def step_lane(self,
+                  lane: SimulationLane,
+                  step,
+                  step_times,
+                  simulation_start,
+                  price_window: Optional[SimulationPriceWindow]):
+        self.live_orders = lane.live_orders
+        self.holding_operations.standard_prices = lane.standard_prices
+        self.random_generator = lane.random_generator
+        try:
+            lane.holdings = self.manage_simulation_per_timestep(lane.holdings,
+                                                                simulation_start,
+                                                                step_times[step],
+                                                                lane.simulation_input_dict)
+        except InsufficientHistory as e:
+            logger.warning(f"Insufficient history. Reason {e}")
+            lane.insufficient_history = True
+            lane.next_step = len(step_times)
+        else:
+            lane.next_step = step + 1 if price_window is None else self.get_next_event_step(lane.holdings,
+                                                                                            step,
+                                                                                            price_window,
+                                                                                            simulation_start,
+                                                                                            lane.simulation_input_dict)
+        lane.live_orders = self.live_orders
+        lane.standard_prices = self.holding_operations.standard_prices
+
+    def create_order_book(self) -> OrderBook:
+        return OrderBook(self.full_dataarray_da_dict.get_price_matrix(self.candle).coin_index)
+
+    def get_candle_value(self,
+                         key,
+                         function,
+                         *args):
+        """`function(*args)`, shared by the lanes stepped at the same candle while a lane walk is running"""
+        if self.candle_cache is None:
+            return function(*args)
+        if key not in self.candle_cache:
+            self.candle_cache[key] = function(*args)
+        return self.candle_cache[key]
+
+    def get_instant_prices(self,
+                           current_time):
+        return self.get_candle_value(("prices", current_time),
+                                     get_instantaneous_prices_from_datarray,
+                                     self.full_dataarray_da_dict,
+                                     current_time,
+                                     self.candle)
+
+    def get_valid_potential_coins(self,
+                                  simulation_input_dict,
+                                  simulation_start,
+                                  simulation_at):
+        # Lanes of a candle differ only in their sell parameters, which the potential coins do not depend on
+        return self.get_candle_value(("potential", simulation_at),
+                                     self.potential_identification.get_valid_potential_coin_to_buy,
+                                     simulation_input_dict,
+                                     simulation_start,
+                                     simulation_at)
+
+    def can_buy_altcoins(self,
+                         holdings,
+                         simulation_input_dict):
+        return self.holding_operations.should_buy_altcoin(holdings) and \
+            len(holdings) <= simulation_input_dict["max_coins_to_buy"] and \
+            self.get_altcoins_numbers_to_buy(simulation_input_dict, holdings) > 0
+
+    def needs_sell_order(self,
+                         holding: HoldingCoin):
+        return holding.coin_name != self.reference_coin and holding.order_instance is None
+
+    def get_order_triggers(self,
+                           order: Order,
+                           simulation_input_dict) -> Optional[List[Tuple[float, bool]]]:
+        """
+        Prices, as (threshold, above), whose crossing can change an open order before its timeout.
+        None when the order has to be looked at every step
+        """
+        return get_fill_triggers(order)
+
+    def is_step_required(self,
+                         holdings,
+                         simulation_input_dict):
+        return any(map(self.needs_sell_order, holdings))
+
+    def get_next_buy_step(self,
+                          holdings,
+                          step,
+                          price_window: SimulationPriceWindow,
+                          simulation_start,
+                          simulation_input_dict):
+        """While buy capacity is free, the next candle at which potential coins can be found"""
+        if not self.can_buy_altcoins(holdings, simulation_input_dict):
+            return len(price_window)
+        refresh_ms = self.potential_identification.get_next_potential_refresh(simulation_input_dict,
+                                                                             simulation_start,
+                                                                             price_window.step_times[step])
+        if refresh_ms is None:
+            return step + 1
+        return price_window.first_step_from(step + 1,
+                                            refresh_ms)
+
+    def get_next_event_step(self,
+                            holdings,
+                            step,
+                            price_window: SimulationPriceWindow,
+                            simulation_start,
+                            simulation_input_dict):
+        """
+        The next step that can change the holdings or the orders: the earliest trigger crossing or timeout
+        of the open orders, or the next potential coin refresh while buy capacity is free
+        """
+        from_step = step + 1
+        if self.is_step_required(holdings, simulation_input_dict):
+            return from_step
+        next_step = self.get_next_buy_step(holdings,
+                                           step,
+                                           price_window,
+                                           simulation_start,
+                                           simulation_input_dict)
+        for order in self.live_orders:
+            if next_step == from_step:
+                break
+            if order.complete == OrderFill.Filled:
+                continue
+            triggers = self.get_order_triggers(order, simulation_input_dict)
+            if triggers is None:
+                return from_step
+            next_step = min(next_step, price_window.cached_event_step(order,
+                                                                      from_step,
+                                                                      self.get_order_event_step,
+                                                                      order,
+                                                                      triggers,
+                                                                      price_window))
+        return next_step
+
+    @staticmethod
+    def get_order_event_step(from_step,
+                             order: Order,
+                             triggers,
+                             price_window: SimulationPriceWindow):
+        order_step = price_window.first_step_after(from_step, order.timeout)
+        # Only the lowest threshold to rise to and the highest one to fall to can be crossed first
+        for above, select_threshold in ((True, min), (False, max)):
+            thresholds = [threshold for threshold, threshold_above in triggers if threshold_above == above]
+            if thresholds:
+                order_step = min(order_step, price_window.first_crossing_step(from_step,
+                                                                              order.base_asset,
+                                                                              select_threshold(thresholds),
+                                                                              above))
+        return order_step
+
     def get_potential_valid_altcoins_no_held(self,
                                              potential_coins: List,
                                              instant_price_dict,
@@ -125,7 +386,7 @@ class AbstractTimestepSimulatorConcrete(ABC):
         potential_coins_set = set(potential_coins)
         potential_valid_altcoin = list(potential_coins_set.intersection(instant_price_dict.keys()))
         potential_valid_altcoin_not_held = list(set(potential_valid_altcoin) -
-                                                set(map(lambda x: x.coin_name, holdings)) -
+                                                set(holdings.get_coin_names()) -
                                                 set(self.banned_coins))
         return potential_valid_altcoin_not_held
 
@@ -137,7 +398,7 @@ class AbstractTimestepSimulatorConcrete(ABC):
 
         quantity_of_ref_avl = self.holding_operations.unlocked_coin_avl(holdings,
                                                                         self.reference_coin)
-        altcoin_holdings_held = len(list(filter(lambda x: x.coin_name != self.reference_coin, holdings)))
+        altcoin_holdings_held = len(holdings) - holdings.count_entries(self.reference_coin)
         return math.ceil(quantity_of_ref_avl / max_ref_coin_in_order) - altcoin_holdings_held
 
     def set_buy_orders_reference_to_alt(self,
@@ -147,10 +408,7 @@ class AbstractTimestepSimulatorConcrete(ABC):
                                         simulation_input_dict,
                                         order_type):
         try:
-            instant_price_dict = get_instantaneous_history_from_datarray(self.full_dataarray_da_dict,
-                                                                         current_time,
-                                                                         candle=self.candle
-                                                                         )
+            instant_price_dict = self.get_instant_prices(current_time)
         except InsufficientHistory:
             return
 
@@ -222,9 +480,9 @@ class AbstractTimestepSimulatorConcrete(ABC):
             ref_qty_available = max_ref_coin_in_order
         return ref_qty_available
 
-    @staticmethod
-    def _random_coin_to_buy(coin_list):
-        coin_to_buy = random.choice(coin_list)
+    def _random_coin_to_buy(self,
+                            coin_list):
+        coin_to_buy = self.random_generator.choice(coin_list)
         coin_list.remove(coin_to_buy)
         return coin_to_buy
 
@@ -254,40 +512,29 @@ class AbstractTimestepSimulatorConcrete(ABC):
             return holdings
 
         try:
-            instant_price_dict = get_instantaneous_history_from_datarray(self.full_dataarray_da_dict,
-                                                                         current_time,
-                                                                         candle=self.candle
-                                                                         )
+            instant_price_dict = self.get_instant_prices(current_time)
         except InsufficientHistory:
             return holdings
-        for order in self.live_orders:
-            if order.complete != OrderFill.Filled:
-                try:
-                    instance_price = instant_price_dict[f'{order.base_asset}']
-                    holdings = self.order_operations.execute_individual_order(holdings,
-                                                                              order,
-                                                                              instance_price,
-                                                                              current_time)
-                except KeyError as e:
-                    logger.warning(
-                        f"Price of {order.base_asset} unavailable at {current_time}. Might be leading to a timeout")
+        # Only the orders past their timeout or with a crossed trigger price can fill
+        for order in self.live_orders.iter_triggered(instant_price_dict.row,
+                                                     current_time):
+            try:
+                instance_price = instant_price_dict[f'{order.base_asset}']
+                holdings = self.order_operations.execute_individual_order(holdings,
+                                                                          order,
+                                                                          instance_price,
+                                                                          current_time)
+            except KeyError as e:
+                logger.warning(
+                    f"Price of {order.base_asset} unavailable at {current_time}. Might be leading to a timeout")
         return holdings
 
     def remove_dead_orders(self,
                            holdings,
                            current_time):
-        all_orders = self.live_orders.copy()
-        self.live_orders = []
-        for order in all_orders:
-            if order.complete == OrderFill.Filled:
-                continue
-
-            if self.order_operations.has_order_reached_timeout(order,
-                                                               current_time):
-                self.holding_operations.unlock_holding(holdings,
-                                                       order)
-            else:
-                self.live_orders.append(order)
+        for order in self.live_orders.pop_timed_out(current_time):
+            self.holding_operations.unlock_holding(holdings,
+                                                   order)
 
     def place_buy_orders_overall(self,
                                  holdings,
@@ -303,9 +550,9 @@ class AbstractTimestepSimulatorConcrete(ABC):
         else:
             raise NotImplementedError
         if self.holding_operations.should_buy_altcoin(holdings):
-            potential_coins = self.potential_identification.get_valid_potential_coin_to_buy(simulation_input_dict,
-                                                                                            simulation_start,
-                                                                                            simulation_at)
+            potential_coins = self.get_valid_potential_coins(simulation_input_dict,
+                                                             simulation_start,
+                                                             simulation_at)
             if potential_coins and \
                     (len(holdings) <= simulation_input_dict["max_coins_to_buy"]):
                 self.set_buy_orders_reference_to_alt(holdings,
@@ -388,7 +635,7 @@ class AbstractTimestepSimulatorConcrete(ABC):
                                                 simulation_input_dict,
                                                 instance_price_dict):
                 self.live_orders.remove(holding.order_instance)
-                holding.order_instance = None
+                holdings.unlock_in_place(holding.order_instance)
             else:
                 return
 
@@ -410,15 +657,16 @@ class AbstractTimestepSimulatorConcrete(ABC):
                                   order_scheme):
         if self.holding_operations.if_altcoins_held(holdings):
             try:
-                instance_price_dict = get_instantaneous_history_from_datarray(self.full_dataarray_da_dict,
-                                                                              current_time,
-                                                                              candle=self.candle
-                                                                              )
+                instance_price_dict = self.get_instant_prices(current_time)
             except InsufficientHistory:
                 logger.debug(f"History not present in {current_time}")
             else:
                 for holding in holdings:
                     if holding.coin_name != self.reference_coin:
+                        if holding.coin_name not in instance_price_dict:
+                            # A gap in the history or a delisted coin, its sell order is placed or re-quoted
+                            # at a later step that has a price
+                            continue
                         if order_scheme == OrderScheme.Limit or order_scheme == OrderScheme.Market:
                             if holding.order_instance is None:
                                 self.limit_sell_overall(holding,
@@ -459,93 +707,70 @@ class HoldingOperations:
             except KeyError:
                 return 1
 
+    def get_initial_holdings(self) -> Holdings:
+        holdings = HoldingsLedger(self.full_history_da_dict.get_price_matrix(self.candle).base_assets.tolist(),
+                                  self.reference_coin)
+        holdings.add_free(self.reference_coin, 1)
+        return holdings
+
     def remove_insignificant_dust(self,
                                   holdings: Holdings,
                                   current_time):
-        significant_holdings = []
         for holding in holdings:
+            if holding.order_instance is not None:
+                # Its order is still in the order book, the entry is left until the order fills or times out
+                continue
             equivalent_value = holding.quantity * self.get_standard_price(holding.coin_name,
                                                                           current_time)
-            if equivalent_value > self.tolerance:
-                significant_holdings.append(holding)
-            else:
+            if equivalent_value <= self.tolerance:
+                holdings.discard(holding)
                 if holding.coin_name in self.dust.keys():
                     self.dust[holding.coin_name] += holding.quantity
                 else:
                     self.dust[holding.coin_name] = holding.quantity
-        return significant_holdings
+        return holdings
+
+    def get_order_replace(self,
+                          order: Order):
+        if order.order_side == OrderSide.Buy:
+            return [self.reference_coin, order.quantity * order.limit_price]
+        return [order.base_asset, order.quantity]
 
     def lock_holding(self,
                      holdings: Holdings,
                      order: Order):
-        if order.order_side == OrderSide.Buy:
-            replace = [self.reference_coin, order.quantity * order.limit_price]
-        else:
-            replace = [order.base_asset, order.quantity]
-
-        for holding_index in range(len(holdings)):
-            holding = holdings[holding_index]
-            if holding.coin_name == replace[0] and holding.order_instance is None:
-                diff = holding.quantity - replace[1]
-                if abs(diff) < self.tolerance:
-                    holding.order_instance = order
-                    return
-                else:
-                    holding.quantity = diff
-                    added_holding = self.order_operations.add_item_to_holdings(holdings,
-                                                                               replace,
-                                                                               order_instance=order)
-                    return
-        raise InsufficientBalance(f"Could not lock {order} as the holdings are only {holdings}")
+        coin_name, quantity = self.get_order_replace(order)
+        holdings.lock(coin_name,
+                      quantity,
+                      order,
+                      self.tolerance)
 
     def unlock_holding(self,
                        holdings: Holdings,
                        order):
-        for holding_index in range(len(holdings)):
-            holding = holdings[holding_index]
-            if holding.order_instance == order:
-                holding.order_instance = None
-                holdings.remove(holding)
-                if order.order_side == OrderSide.Buy:
-                    replace = [self.reference_coin, order.quantity * order.limit_price]
-                else:
-                    replace = [order.base_asset, order.quantity]
-                self.order_operations.add_item_to_holdings(holdings,
-                                                           replace,
-                                                           order_instance=None)
-                return
-        raise InsufficientBalance(f"Could not unlock {order} as the holdings are only {holdings}")
+        holdings.release(order)
+        self.order_operations.add_item_to_holdings(holdings,
+                                                   self.get_order_replace(order),
+                                                   order_instance=None)
 
     @staticmethod
     def unlocked_coin_avl(holdings: Holdings,
                           coin_name: str):
-        for holding in holdings:
-            if holding.coin_name == coin_name:
-                if holding.order_instance is None:
-                    return holding.quantity
-        return 0
+        return holdings.get_free_quantity(coin_name)
 
     def if_altcoins_held(self,
                          holdings: Holdings):
-        return not ((len(holdings) == 1) and (holdings[0].coin_name == self.reference_coin))
+        return not ((len(holdings) == 1) and (holdings.count_entries(self.reference_coin) == 1))
 
     def should_buy_altcoin(self,
                            holdings: Holdings,
                            ) -> bool:
-        for holding in holdings:
-            if holding.coin_name == self.reference_coin:
-                if holding.order_instance is None:
-                    if holding.quantity > self.tolerance:
-                        return True
-        return False
+        return holdings.get_free_quantity(self.reference_coin) > self.tolerance
 
     @staticmethod
     def get_coin_qty(holdings: Holdings,
                      coin_name: str):
-        for holding in holdings:
-            if holding.coin_name == coin_name:
-                return holding.quantity
-        raise InsufficientBalance("Coin not in the list")
+        return holdings.get_first_quantity(coin_name)
 
     def log_holding_value(self,
                           holdings,
@@ -572,15 +797,14 @@ class HoldingOperations:
         return instance_price_dict
 
     def get_total_holding_worth(self,
-                                holdings,
+                                holdings: Holdings,
                                 current_time):
-        instant_price_dict = self.get_instant_price_dict(current_time)
+        price_matrix = self.full_history_da_dict.get_price_matrix(self.candle)
         try:
-            return functools.reduce(
-                lambda x, y: x + y.quantity * instant_price_dict[y.coin_name],
-                holdings, 0)
-        except KeyError as e:
+            price_row = price_matrix.row(datetime_to_ms(current_time))
+        except KeyError:
             return 0
+        return holdings.get_total_worth(price_row)
 
 
 class OrderOperations:
@@ -650,28 +874,24 @@ class OrderOperations:
                              order_instance=None
                              ):
         if order_instance is None:
-            for holding in holdings:
-                if holding.coin_name == add[0]:
-                    if holding.order_instance is None:
-                        holding.quantity = holding.quantity + add[1]
-                        return holding
-        added_holding = HoldingCoin(coin_name=add[0],
-                                    quantity=add[1],
-                                    order_instance=order_instance)
-        holdings.append(added_holding)
-        return added_holding
+            holdings.add_free(*add)
+        else:
+            holdings.add_locked(*add, order_instance)
 
     @staticmethod
     def remove_item_from_holdings(holdings: Holdings,
                                   order_instance):
-        for holding_index in range(len(holdings)):
-            if holdings[holding_index].order_instance == order_instance:
-                holdings.pop(holding_index)
-                return
-        raise InsufficientBalance(f"Did not have {order_instance} to remove from holdings {holdings}")
+        holdings.release(order_instance)
 
 
 class MarketBuyLimitSellSimulatorConcrete(AbstractTimestepSimulatorConcrete):
+    def is_step_required(self,
+                         holdings,
+                         simulation_input_dict):
+        # The dust check reloads the standard prices at the current candle for coins missing from them
+        return super(MarketBuyLimitSellSimulatorConcrete, self).is_step_required(holdings, simulation_input_dict) or \
+            any(holding.coin_name not in self.holding_operations.standard_prices for holding in holdings)
+
     def manage_simulation_per_timestep(self,
                                        holdings: List,
                                        simulation_start: datetime.datetime,
@@ -736,6 +956,22 @@ class LimitBuyLimitSellSimulatorConcrete(AbstractTimestepSimulatorConcrete):
 
 
 class MarketBuyTrailingSellSimulatorConcrete(AbstractTimestepSimulatorConcrete):
+    def needs_sell_order(self,
+                         holding: HoldingCoin):
+        return super(MarketBuyTrailingSellSimulatorConcrete, self).needs_sell_order(holding) and \
+            holding.quantity > self.tolerance
+
+    def get_order_triggers(self,
+                           order: Order,
+                           simulation_input_dict) -> Optional[List[Tuple[float, bool]]]:
+        triggers = super(MarketBuyTrailingSellSimulatorConcrete, self).get_order_triggers(order,
+                                                                                           simulation_input_dict)
+        if triggers is not None and order.order_side == OrderSide.Sell:
+            # Re-quoted as soon as the price is strictly above the trigger, see is_order_close_to_execution
+            trigger_price_move_order = order.limit_price * (1 - simulation_input_dict["limit_sell_adjust_trail"])
+            triggers.append((float(np.nextafter(trigger_price_move_order, np.inf)), True))
+        return triggers
+
     def manage_simulation_per_timestep(self,
                                        holdings: List,
                                        simulation_start: datetime.datetime,
@@ -766,8 +1002,27 @@ class MarketBuyTrailingSellSimulatorConcrete(AbstractTimestepSimulatorConcrete):
         return holdings
 
 
+class VectorizedMarketBuyLimitSellSimulationCreator(MarketBuyLimitSellSimulationCreator):
+    event_driven = True
+
+
+class VectorizedMarketBuyTrailingSellSimulationCreator(MarketBuyTrailingSellSimulationCreator):
+    event_driven = True
+
+
+class VectorizedLimitBuyLimitSellSimulationCreator(LimitBuyLimitSellSimulationCreator):
+    event_driven = True
+
+
 def calculate_simulation_client(creator: AbstractTimeStepSimulateCreator,
                                 *args,
                                 **kwargs):
     return creator.simulate_timesteps(*args,
                                       **kwargs)
+
+
+def calculate_simulation_lanes_client(creator: AbstractTimeStepSimulateCreator,
+                                      *args,
+                                      **kwargs):
+    return creator.simulate_timestep_lanes(*args,
+                                           **kwargs)
@@ -0,0 +1,47 @@
+import logging
+from datetime import datetime, timedelta
+
+from crypto_history import class_builders, init_logger
+from crypto_oversold.emit_data.sqlalchemy_operations import OversoldCoins
+
+from backtest_crypto.history_collect.gather_history import store_largest_xarray
+from backtest_crypto.verify.identify_potential_coins import ApproximateOversoldCreator, get_potential_divergence
+
+
+def main():
+    init_logger(logging.INFO)
+    overall_start = datetime(day=25, month=8, year=2018)
+    overall_end = datetime(day=20, month=5, year=2021)
+    reference_coin = "BTC"
+    ohlcv_field = "open"
+    candle = "1h"
+    data_source_general = "sqlite"
+
+    table_name_list = [f"COIN_HISTORY_{ohlcv_field}_{reference_coin}_1d",
+                       f"COIN_HISTORY_{ohlcv_field}_{reference_coin}_1h"]
+
+    sqlite_access_creator = class_builders.get("access_xarray").get(data_source_general)()
+
+    full_history_da_dict = store_largest_xarray(sqlite_access_creator,
+                                                overall_start=overall_start,
+                                                overall_end=overall_end,
+                                                candle=candle,
+                                                reference_coin=reference_coin,
+                                                ohlcv_field=ohlcv_field,
+                                                file_path="/Users/vikram/Documents/Personal/s3_sync/25_Jan_2017_TO_23_May_2021_BTC_1h_1d.db",
+                                                mapped_class=OversoldCoins,
+                                                table_name_list=table_name_list)
+
+    history_start = datetime(day=1, month=3, year=2021)
+    history_ends = [history_start + timedelta(days=days) for days in range(1, 31)]
+    divergence = get_potential_divergence(full_history_da_dict,
+                                          history_start,
+                                          history_ends,
+                                          {"ohlcv_field": ohlcv_field},
+                                          ApproximateOversoldCreator())
+    print(divergence.to_string())
+    print(divergence.describe().to_string())
+
+
+if __name__ == "__main__":
+    main()
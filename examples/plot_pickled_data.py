@@ -17,9 +17,9 @@ def plot_simulation():
     with open(pickle_file, "rb") as fp:
         simulated_dataset = pickle.load(fp)
     for item in simulated_dataset:
-        simulated_dataset[item] = simulated_dataset[item].dropna("time_intervals")
+        simulated_dataset[item] = simulated_dataset[item].dropna("interval_end")
         simulated_dataset[item] = simulated_dataset[item].fillna(0)
-    # simulated_dataset = simulated_dataset.sel(time_intervals=simulated_dataset.time_intervals[1:-1])
+    # simulated_dataset = simulated_dataset.isel(interval_end=slice(1, -1))
     show_graph(SurfaceGraph3DCreator(),
                simulated_dataset,
                data_vars=[
@@ -56,7 +56,7 @@ def plot_indicator():
         simulated_dataset = pickle.load(fp)
     for item in simulated_dataset:
         simulated_dataset[item] = simulated_dataset[item].fillna(0)
-    simulated_dataset = simulated_dataset.sel(time_intervals=simulated_dataset.time_intervals[1:-1])
+    simulated_dataset = simulated_dataset.isel(interval_end=slice(1, -1))
     show_graph(SurfaceGraph3DCreator(),
                simulated_dataset,
                data_vars=[
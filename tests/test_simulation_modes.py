@@ -0,0 +1,202 @@
+import datetime
+import random
+
+import numpy as np
+import pytest
+
+from backtest_crypto.history_collect.gather_history import FullHistoryStore
+from backtest_crypto.history_collect.price_matrix import PriceMatrix
+from backtest_crypto.utilities.general import datetime_to_ms
+from backtest_crypto.utilities.iterators import TimeIntervalIterator, ManualSourceIterators, ManualSuccessIterators
+from backtest_crypto.verify import gather_overall
+from backtest_crypto.verify.identify_potential_coins import PotentialCoinClient
+from backtest_crypto.verify.potential_store import PotentialScoreStore
+from backtest_crypto.verify.simulate_timesteps import MarketBuyLimitSellSimulationCreator, \
+    MarketBuyTrailingSellSimulationCreator, LimitBuyLimitSellSimulationCreator, \
+    VectorizedMarketBuyLimitSellSimulationCreator, VectorizedMarketBuyTrailingSellSimulationCreator, \
+    VectorizedLimitBuyLimitSellSimulationCreator
+
+START = datetime.datetime(2020, 1, 1)
+END = START + datetime.timedelta(days=30)
+COINS = [f"C{number}" for number in range(8)]
+
+
+def get_random_walk(rng,
+                    candle: datetime.timedelta,
+                    periods: int) -> PriceMatrix:
+    values = np.exp(np.cumsum(rng.normal(0, 0.02, size=(periods, len(COINS))), axis=0))
+    values[rng.random(values.shape) < 0.02] = np.nan
+    # A coin listed late
+    values[:periods // 3, 0] = np.nan
+    timestamps = np.array([datetime_to_ms(START + candle * row) for row in range(periods)], dtype=np.int64)
+    return PriceMatrix(values, timestamps, np.array(COINS))
+
+
+class SourceIterators(ManualSourceIterators):
+    def cutoff_mean(self):
+        return [1.5, 2.5]
+
+    def cutoff_deviation(self):
+        return [1]
+
+    def max_coins_to_buy(self):
+        return [2, 4]
+
+
+class SuccessIterators(ManualSuccessIterators):
+    def percentage_increase(self):
+        return [0.005, 0.03]
+
+    def stop_price_sell(self):
+        return [0.01, 0.03]
+
+    def limit_sell_adjust_trail(self):
+        return [0.005, 0.02]
+
+    def percentage_reduction(self):
+        return [0.01]
+
+    def days_to_run(self):
+        return [datetime.timedelta(days=3)]
+
+
+@pytest.fixture
+def full_history_da_dict():
+    rng = np.random.default_rng(1)
+    return FullHistoryStore.from_price_matrices({"1h": get_random_walk(rng, datetime.timedelta(hours=1), 24 * 30),
+                                                 "1d": get_random_walk(rng, datetime.timedelta(days=1), 30)},
+                                                reference_coin="BTC",
+                                                ohlcv_field="open")
+
+
+@pytest.fixture
+def time_interval_iterator():
+    return TimeIntervalIterator(START + datetime.timedelta(days=5),
+                                START + datetime.timedelta(days=25),
+                                "8d",
+                                forward_in_time=False,
+                                increasing_range=False)
+
+
+@pytest.fixture
+def potential_coin_path(tmp_path,
+                        time_interval_iterator):
+    rng = np.random.default_rng(7)
+    potential_store = PotentialScoreStore()
+    for history_start, history_end in time_interval_iterator.time_intervals:
+        window_end = history_start
+        while window_end <= history_end:
+            if (history_start, window_end) not in potential_store:
+                potential_store.add_pair(history_start,
+                                         window_end,
+                                         {coin: float(rng.uniform(0, 4)) for coin in COINS if rng.random() < 0.8})
+            window_end += datetime.timedelta(hours=6)
+    path = tmp_path / "potential.pickle"
+    potential_store.to_series().to_pickle(path)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def clear_potential_client():
+    PotentialCoinClient._shared_state.clear()
+    yield
+    PotentialCoinClient._shared_state.clear()
+
+
+def get_gather_simulation(full_history_da_dict,
+                          time_interval_iterator,
+                          potential_coin_path,
+                          strategy,
+                          **kwargs):
+    source_iterators = SourceIterators()
+    success_iterators = SuccessIterators()
+    iterators = {"time": time_interval_iterator,
+                 "source": [source_iterators.cutoff_mean,
+                            source_iterators.cutoff_deviation,
+                            source_iterators.max_coins_to_buy],
+                 "success": [success_iterators.percentage_increase,
+                             success_iterators.percentage_reduction,
+                             success_iterators.days_to_run,
+                             success_iterators.stop_price_sell,
+                             success_iterators.limit_sell_adjust_trail],
+                 "target": ["calculate_end_of_run_value"],
+                 "strategy": [strategy]}
+    return gather_overall.GatherSimulation(full_history_da_dict,
+                                           "BTC",
+                                           "open",
+                                           iterators,
+                                           potential_coin_path=potential_coin_path,
+                                           **kwargs)
+
+
+def get_all_task_indices(gather_simulation):
+    task_indices = []
+    for time_interval in gather_simulation.yield_time_intervals():
+        task_indices.extend(gather_simulation.get_task_indices(time_interval, END, START))
+    return task_indices
+
+
+def get_end_of_run_value(sim_result):
+    return None if sim_result is None else sim_result["calculate_end_of_run_value"]
+
+
+def simulate_per_task(gather_simulation):
+    results = {}
+    for indices in get_all_task_indices(gather_simulation):
+        # Every task starts from the same random state, as the lanes of a group do
+        random.seed(0)
+        sim_result = gather_simulation.execute_simulation("open",
+                                                          gather_simulation.parameter_grid.coordinate_dict(indices),
+                                                          gather_simulation.potential_client,
+                                                          gather_simulation.target_iterators,
+                                                          gather_simulation.full_history_da_dict)
+        results[indices] = get_end_of_run_value(sim_result)
+    return results
+
+
+def simulate_lanes(gather_simulation):
+    results = {}
+    for lane_indices in gather_simulation.group_sell_parameter_lanes(get_all_task_indices(gather_simulation)):
+        random.seed(0)
+        sim_results = gather_simulation.execute_simulation_lanes("open",
+                                                                 [gather_simulation.parameter_grid.coordinate_dict(
+                                                                     indices) for indices in lane_indices],
+                                                                 gather_simulation.potential_client,
+                                                                 gather_simulation.target_iterators,
+                                                                 gather_simulation.full_history_da_dict)
+        for indices, sim_result in zip(lane_indices, sim_results):
+            results[indices] = get_end_of_run_value(sim_result)
+    return results
+
+
+@pytest.mark.parametrize("per_candle_strategy, event_driven_strategy", [
+    (MarketBuyLimitSellSimulationCreator, VectorizedMarketBuyLimitSellSimulationCreator),
+    (MarketBuyTrailingSellSimulationCreator, VectorizedMarketBuyTrailingSellSimulationCreator),
+    (LimitBuyLimitSellSimulationCreator, VectorizedLimitBuyLimitSellSimulationCreator),
+])
+def test_per_candle_event_driven_and_lanes_agree(full_history_da_dict,
+                                                  time_interval_iterator,
+                                                  potential_coin_path,
+                                                  per_candle_strategy,
+                                                  event_driven_strategy):
+    per_candle = simulate_per_task(get_gather_simulation(full_history_da_dict,
+                                                         time_interval_iterator,
+                                                         potential_coin_path,
+                                                         per_candle_strategy))
+    event_driven = simulate_per_task(get_gather_simulation(full_history_da_dict,
+                                                           time_interval_iterator,
+                                                           potential_coin_path,
+                                                           event_driven_strategy))
+    lanes = simulate_lanes(get_gather_simulation(full_history_da_dict,
+                                                 time_interval_iterator,
+                                                 potential_coin_path,
+                                                 per_candle_strategy,
+                                                 sell_parameter_lanes=True))
+    assert any(value is not None for value in per_candle.values())
+    assert event_driven.keys() == per_candle.keys() == lanes.keys()
+    for indices, value in per_candle.items():
+        if value is None:
+            assert event_driven[indices] is None and lanes[indices] is None
+        else:
+            assert event_driven[indices] == pytest.approx(value, rel=1e-9)
+            assert lanes[indices] == pytest.approx(value, rel=1e-9)